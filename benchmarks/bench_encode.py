@@ -0,0 +1,64 @@
+"""Compare utils.df2bytes with the row-by-row encoder it replaced.
+
+    python benchmarks/bench_encode.py --max-rows 10000000
+"""
+import os
+import sys
+import time
+import argparse
+
+import numpy
+import pandas
+
+# Run from a checkout without installing mcmder.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from mcmder.utils import df2bytes
+
+
+def legacy_df2bytes(dataframe):
+    """The encoder of mcmder 0.2.0, which joined str() of each value."""
+    return '\n'.join(
+        [','.join(dataframe), ] +
+        [','.join(map(str, row)) for row in dataframe.values]
+    ).encode()
+
+
+def make_frame(rows, seed=0):
+    random = numpy.random.RandomState(seed)
+    return pandas.DataFrame({
+        'id': random.randint(0, 1 << 30, rows),
+        'key': numpy.char.add('k', random.randint(0, 1000, rows).astype(str)),
+        'amount': random.randn(rows),
+        'count': random.randint(0, 100, rows),
+    })
+
+
+def best_of(function, repeat):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - started)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--max-rows', type=int, default=10 ** 6)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    print('%10s %12s %12s %8s' % ('rows', 'legacy [s]', 'df2bytes [s]', 'speedup'))
+    rows = 10 ** 4
+    while rows <= args.max_rows:
+        dataframe = make_frame(rows)
+        legacy = best_of(lambda: legacy_df2bytes(dataframe), args.repeat)
+        current = best_of(lambda: df2bytes(dataframe), args.repeat)
+        print('%10d %12.4f %12.4f %7.1fx' % (
+            rows, legacy, current, legacy / current))
+        rows *= 10
+
+
+if __name__ == '__main__':
+    main()
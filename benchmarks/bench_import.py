@@ -0,0 +1,52 @@
+"""Measure the time of `import mcmder` and check it does not load pandas.
+
+    python benchmarks/bench_import.py --repeat 10
+
+Exits with status 1 if a heavy module is imported along with mcmder.
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules loaded only when they are used.
+LAZY_MODULES = ('pandas', 'numpy', 'pyarrow', 'asyncio')
+
+_SCRIPT = '''
+import sys, time, json
+started = time.perf_counter()
+import mcmder
+print(json.dumps([time.perf_counter() - started,
+                  [name for name in %r if name in sys.modules]]))
+''' % (LAZY_MODULES,)
+
+
+def import_once():
+    """Import mcmder in a new interpreter.
+
+    :return: (seconds to import, lazy modules imported)
+    :rtype: tuple
+    """
+    output = subprocess.check_output([sys.executable, '-c', _SCRIPT],
+                                     cwd=ROOT)
+    return tuple(json.loads(output.decode()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    results = [import_once() for _ in range(args.repeat)]
+    loaded = sorted(set(name for _, names in results for name in names))
+    print('import mcmder: best %.4f s of %d' % (
+        min(seconds for seconds, _ in results), args.repeat))
+    if loaded:
+        print('imported eagerly: %s' % ', '.join(loaded))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+"""Benchmark building, encoding, running and parsing with stub commands.
+
+The commands are the stand-ins of benchmarks/stubs/mstub.py, so the suite
+runs without Nysol installed. It times what mcmder itself adds: building
+chains, encoding a DataFrame input, spawning processes, moving bytes through
+the pipes and parsing the result.
+
+    python benchmarks/bench_suite.py --output baseline.json
+    python benchmarks/bench_suite.py --compare baseline.json --tolerance 0.2
+
+With --compare, it exits with 1 if any benchmark got slower than the
+baseline by more than the tolerance.
+"""
+import io
+import os
+import sys
+import json
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+
+from bench_encode import ROOT, make_frame, best_of
+
+STUBS = ('mcut', 'msel', 'msortf', 'msum', 'mtee')
+
+# Chains built per timing of the chain building.
+_CHAINS = 1000
+
+
+def install_stubs(directory):
+    """Write the stub commands into directory, run by this interpreter."""
+    stubs = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stubs')
+    for name in STUBS:
+        path = os.path.join(directory, name)
+        with open(path, 'w') as stub:
+            stub.write('#!%s\nimport sys\nsys.path.insert(0, %r)\n'
+                       'import mstub\nsys.exit(mstub.main(%r))\n'
+                       % (sys.executable, stubs, name))
+        os.chmod(path, 0o755)
+
+
+def bench_import(repeat):
+    command = [sys.executable, '-c', 'import mcmder']
+    return best_of(lambda: subprocess.check_call(command, cwd=ROOT), repeat)
+
+
+def bench_build(Mcmder, frame, repeat, validate=True):
+    """Build chains, checking the parameters by the registry if validate."""
+    def build():
+        for _ in range(_CHAINS):
+            Mcmder(frame, validate=validate).mcut(f='id,key,amount') \
+                .msel(c='${amount}>0').msortf(f='key') \
+                .msum(k='key', f='amount')
+    return best_of(build, repeat) / _CHAINS
+
+
+def bench_encode(df2bytes, frame, repeat):
+    return best_of(lambda: df2bytes(frame), repeat)
+
+
+def bench_pipe(Mcmder, path, repeat):
+    """Pass a file through three commands; on a tiny file, only spawning."""
+    mcmder = Mcmder(path, validate=False).msel(c='1').msel(c='1').msel(c='1')
+    return best_of(lambda: mcmder.execute(stdout=True), repeat)
+
+
+def bench_parse(Mcmder, output, repeat):
+    mcmder = Mcmder(None, validate=False)
+    return best_of(lambda: mcmder._parse(io.BytesIO(output)), repeat)
+
+
+def bench_chain(Mcmder, frame, repeat):
+    def run():
+        Mcmder(frame, validate=False).mcut(f='key,amount') \
+            .msum(k='key', f='amount').dataframe
+    return best_of(run, repeat)
+
+
+def run_suite(sizes, repeat):
+    """Return {benchmark name: best seconds}."""
+    from mcmder import Mcmder
+    from mcmder.utils import df2bytes
+    results = {'import': bench_import(repeat)}
+    small = make_frame(100)
+    results['build/commands=4'] = bench_build(Mcmder, small, repeat)
+    results['build/no-validate'] = bench_build(
+        Mcmder, small, repeat, validate=False)
+    workdir = tempfile.mkdtemp(prefix='mcmder-bench-')
+    try:
+        tiny = os.path.join(workdir, 'tiny.csv')
+        small.to_csv(tiny, index=False)
+        results['spawn/commands=3'] = bench_pipe(Mcmder, tiny, repeat)
+        for rows in sizes:
+            frame = make_frame(rows)
+            path = os.path.join(workdir, '%d.csv' % rows)
+            frame.to_csv(path, index=False)
+            with open(path, 'rb') as csv_file:
+                output = csv_file.read()
+            name = 'rows=%d' % rows
+            results['encode/' + name] = bench_encode(df2bytes, frame, repeat)
+            results['pipe/' + name] = bench_pipe(Mcmder, path, repeat)
+            results['parse/' + name] = bench_parse(Mcmder, output, repeat)
+            results['chain/' + name] = bench_chain(Mcmder, frame, repeat)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Print the ratio to the baseline and return the names regressed."""
+    regressed = []
+    print('%-24s %12s %12s %8s' % ('benchmark', 'baseline [s]', 'now [s]',
+                                   'ratio'))
+    for name, seconds in sorted(results.items()):
+        before = baseline.get(name)
+        if before is None:
+            print('%-24s %12s %12.6f %8s' % (name, '-', seconds, 'new'))
+            continue
+        ratio = seconds / before
+        mark = ''
+        if ratio > 1 + tolerance:
+            regressed.append(name)
+            mark = ' slower'
+        print('%-24s %12.6f %12.6f %7.2fx%s' % (
+            name, before, seconds, ratio, mark))
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1000,10000,100000',
+                        help='comma separated rows of the inputs')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='write the results as json')
+    parser.add_argument('--compare', help='json written by --output')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='slowdown allowed by --compare, 0.25 is 25%%')
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(',')]
+    bindir = tempfile.mkdtemp(prefix='mcmder-stubs-')
+    home = tempfile.mkdtemp(prefix='mcmder-home-')
+    try:
+        install_stubs(bindir)
+        os.environ['PATH'] = bindir + os.pathsep + os.environ['PATH']
+        # Keep the caches of the user out of the measurement.
+        os.environ['HOME'] = home
+        results = run_suite(sizes, args.repeat)
+    finally:
+        shutil.rmtree(bindir, ignore_errors=True)
+        shutil.rmtree(home, ignore_errors=True)
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'sizes': sizes,
+        'repeat': args.repeat,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+    elif not args.output:
+        for name, seconds in sorted(results.items()):
+            print('%-24s %12.6f' % (name, seconds))
+
+
+if __name__ == '__main__':
+    main()
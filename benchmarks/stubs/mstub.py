@@ -0,0 +1,134 @@
+"""Stand-ins of a few M-Command commands for the benchmarks.
+
+They parse the same parameters as the real commands, but only pass the
+records through or transform them lightly in Python:
+
+  mcut f=a,b:c   select and rename fields
+  mfldname f=a:x rename fields
+  msel c=...     pass all the records through; the condition is ignored
+  msortf f=a,b   sort by the fields as strings
+  msum k=a f=b   sum the fields for each key
+  mtee o=path    copy the records into the file and stdout
+"""
+import io
+import os
+import csv
+import sys
+import shutil
+
+PARAMS = {
+    'mcut': 'f=,i=,o=,-r,-nfn,-nfno,-q,-x',
+    'mfldname': 'f=,n=,i=,o=,-nfn,-nfno,-q',
+    'msel': 'c=,i=,o=,u=,-r,-nfn,-nfno,-q',
+    'msortf': 'f=,i=,o=,pways=,maxlines=,threadCnt=,-nfn,-nfno,-q',
+    'msum': 'f=,k=,i=,o=,-nfn,-nfno,-q',
+    'mtee': 'i=,o=,-nfn,-nfno,-q',
+}
+
+
+def parse(args):
+    options, flags = {}, set()
+    for arg in args:
+        if arg.startswith('-'):
+            flags.add(arg[1:])
+        elif '=' in arg:
+            name, value = arg.split('=', 1)
+            options[name] = value
+    return options, flags
+
+
+def open_input(options):
+    if 'i' in options:
+        return open(options['i'], 'rb')
+    return sys.stdin.buffer
+
+
+def open_output(options):
+    if 'o' in options:
+        return open(options['o'], 'wb')
+    return sys.stdout.buffer
+
+
+def read_records(stream, header):
+    reader = csv.reader(io.TextIOWrapper(stream, encoding='utf-8',
+                                         newline=''))
+    fields = next(reader, []) if header else None
+    return fields, reader
+
+
+def write_records(stream, fields, records, header):
+    text = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+    writer = csv.writer(text, lineterminator='\n')
+    if header and fields is not None:
+        writer.writerow(fields)
+    writer.writerows(records)
+    text.flush()
+    text.detach()
+
+
+def index_of(fields, names):
+    return [int(name) if fields is None else fields.index(name)
+            for name in names]
+
+
+def mcut(options, fields, records):
+    names = [field.split(':')[0] for field in options['f'].split(',')]
+    renamed = [field.split(':')[-1] for field in options['f'].split(',')]
+    index = index_of(fields, names)
+    return renamed, ([record[i] for i in index] for record in records)
+
+
+def mfldname(options, fields, records):
+    renames = dict(field.split(':', 1) for field in options['f'].split(','))
+    return [renames.get(field, field) for field in fields], records
+
+
+def msortf(options, fields, records):
+    index = index_of(fields, [field.split('%')[0]
+                              for field in options['f'].split(',')])
+    return fields, sorted(records,
+                          key=lambda record: [record[i] for i in index])
+
+
+def msum(options, fields, records):
+    keys = index_of(fields, options['k'].split(','))
+    values = index_of(fields, options['f'].split(','))
+    sums = {}
+    for record in records:
+        key = tuple(record[i] for i in keys)
+        total = sums.setdefault(key, [0.0] * len(values))
+        for position, i in enumerate(values):
+            total[position] += float(record[i] or 0)
+    out_fields = None if fields is None else \
+        [fields[i] for i in keys] + [fields[i] for i in values]
+    return out_fields, (list(key) + ['%.10g' % value for value in total]
+                        for key, total in sorted(sums.items()))
+
+
+def main(name, args=None):
+    options, flags = parse(sys.argv[1:] if args is None else args)
+    if 'params' in flags:
+        print(PARAMS[name])
+        return 0
+    header = 'nfn' not in flags
+    source = open_input(options)
+    if name == 'msel':
+        # Pure pass-through: measures the pipes, not the stub.
+        shutil.copyfileobj(source, open_output(options), 1 << 16)
+        return 0
+    if name == 'mtee':
+        with open(options['o'], 'wb') as copy:
+            for chunk in iter(lambda: source.read(1 << 16), b''):
+                copy.write(chunk)
+                sys.stdout.buffer.write(chunk)
+        return 0
+    fields, records = read_records(source, header)
+    fields, records = globals()[name](options, fields, records)
+    output = open_output(options)
+    write_records(output, fields, records, header and 'nfno' not in flags)
+    output.flush()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(os.path.basename(sys.argv[0])))
@@ -14,3 +14,6 @@ __copyright__ = 'Copyright 2018 Yusuke Hayashi'
 __version__ = '0.2.0'
 
 from .mcmder import Mcmder
+from .cache import ResultCache
+from .resources import ResourcePolicy
+from .compression import Compression
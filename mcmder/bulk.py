@@ -0,0 +1,122 @@
+"""Run one M-Command chain over many input files."""
+import os
+import glob
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from .compression import open_output
+from .errors import McmderError
+
+
+class MapResult(object):
+    """Result of Mcmder.map_files.
+
+    Attributes:
+      outputs: dict of input file path to csv file path of its result
+      errors: dict of input file path to the exception raised for it
+      output: path of the merged csv, or None if results are not merged
+    """
+
+    def __init__(self, files):
+        self.files = files
+        self.outputs = {}
+        self.errors = {}
+        self.output = None
+
+    @property
+    def ok(self):
+        return not self.errors
+
+    def raise_for_errors(self):
+        """Raise McmderError if any file failed."""
+        if self.errors:
+            raise McmderError('%d of %d files failed:\n%s' % (
+                len(self.errors), len(self.files),
+                '\n'.join('%s: %s' % (path, error)
+                          for path, error in self.errors.items())))
+
+    def __repr__(self):
+        return '<MapResult files=%d errors=%d output=%r>' % (
+            len(self.files), len(self.errors), self.output)
+
+
+def map_files(mcmder_class, files, pipeline_fn, workers=None, output=None,
+              reduce=None, header=True, output_dir=None, **kwargs):
+    """Run pipeline_fn(Mcmder(file)) for each file and save each result.
+
+    Each job spends its time in M-Command processes, so a thread per
+    running job is enough to keep workers cores busy.
+    :param type mcmder_class: Mcmder or its subclass
+    :param str or list files: glob pattern or list of file paths
+    :param callable pipeline_fn: takes Mcmder of a file and returns Mcmder
+    :param int workers: number of files run at once, cpu count by default
+    :param str output: file path to write the merged result
+    :param callable reduce: takes Mcmder of the concatenated results and
+      returns Mcmder to write into output
+    :param bool header: input files have header, and so do their results
+    :param str output_dir: directory for the result of each file
+    :param kwargs: keyword arguments of each Mcmder, like engine
+    :rtype: MapResult
+    """
+    if isinstance(files, str):
+        files = sorted(glob.glob(files))
+    if reduce is not None and output is None:
+        raise ValueError('reduce needs output.')
+    result = MapResult(list(files))
+    remove_dir = output_dir is None and output is not None
+    if output_dir is None:
+        output_dir = tempfile.mkdtemp(prefix='mcmder-')
+
+    def run(index, path):
+        result_path = os.path.join(output_dir, '%06d.csv' % index)
+        pipeline_fn(mcmder_class(path, header, **kwargs)).save(result_path)
+        return result_path
+
+    try:
+        with ThreadPoolExecutor(workers or os.cpu_count()) as executor:
+            futures = [(path, executor.submit(run, index, path))
+                       for index, path in enumerate(result.files)]
+            for path, future in futures:
+                try:
+                    result.outputs[path] = future.result()
+                except Exception as error:
+                    result.errors[path] = error
+        if output is not None and result.outputs:
+            merged = [result.outputs[path] for path in result.files
+                      if path in result.outputs]
+            if reduce is None:
+                concat_csv(merged, output, header)
+            else:
+                concat_dir = tempfile.mkdtemp(prefix='mcmder-')
+                try:
+                    concatenated = os.path.join(concat_dir, 'concat.csv')
+                    concat_csv(merged, concatenated, header)
+                    reduced = reduce(
+                        mcmder_class(concatenated, header, **kwargs))
+                    reduced.save(output)
+                finally:
+                    shutil.rmtree(concat_dir, ignore_errors=True)
+            result.output = output
+    finally:
+        if remove_dir:
+            shutil.rmtree(output_dir, ignore_errors=True)
+            result.outputs = {}
+    return result
+
+
+def concat_csv(paths, output_file, header=True):
+    """Concatenate csv files with the same header into output_file.
+
+    :param list paths: csv file paths
+    :param str output_file: file path to write
+    :param bool header: files have header, which is written only once
+    """
+    with open_output(output_file) as output:
+        for index, path in enumerate(paths):
+            with open(path, 'rb') as csv_file:
+                if header:
+                    first = csv_file.readline()
+                    if index == 0:
+                        output.write(first)
+                shutil.copyfileobj(csv_file, output)
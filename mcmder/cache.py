@@ -0,0 +1,230 @@
+"""Cache results of M-Command on disk."""
+import os
+import shutil
+import hashlib
+import tempfile
+
+from .compression import open_output
+from .executor import PipelineBase
+from .utils import split_stages, stage_options, is_dataframe
+
+
+def fingerprint(mcmd_args, input_data=None, inputs=None, float_format=None):
+    """Return a hex digest of M-Command arguments and their inputs.
+
+    Files given as i= or m= are identified by path, size and mtime, a
+    DataFrame input by a hash of its values, index and columns and the
+    float_format it is written with, and a Mcmder given as an option by its
+    cache_key.
+    :param list mcmd_args: arguments of M-Command
+    :param str or pandas.DataFrame input_data: input of Mcmder
+    :param list inputs: DataFrame or Mcmder given as options
+    :param str float_format: format of floats of the DataFrames
+    :rtype: str
+    """
+    digest = hashlib.sha256(' '.join(mcmd_args).encode())
+    for stage in split_stages(mcmd_args):
+        for name, value in sorted(stage_options(stage).items()):
+            for path in value.split(',') if name in ('i', 'm') else []:
+                if os.path.isfile(path):
+                    stat = os.stat(path)
+                    digest.update(('\0%s\0%d\0%d' % (
+                        os.path.abspath(path), stat.st_size,
+                        stat.st_mtime_ns)).encode())
+    for data in [input_data] + list(inputs or []):
+        if is_dataframe(data):
+            import pandas
+            digest.update(('\0DataFrame\0%r' % float_format).encode())
+            digest.update(repr(list(data.columns)).encode())
+            digest.update(repr(list(data.dtypes)).encode())
+            digest.update(pandas.util.hash_pandas_object(
+                data, index=True).values.tobytes())
+        elif data is not None and not isinstance(data, str):
+            digest.update(('\0Mcmder\0' + data.cache_key).encode())
+    return digest.hexdigest()
+
+
+class ResultCache(object):
+    """Directory of executed results keyed by statement and input.
+
+    Each entry is the csv output of a chain, and the parsed DataFrame once
+    it was read. The least recently used entries are removed while the
+    directory is larger than max_bytes.
+    Attributes:
+      directory, max_bytes, hits, misses
+    """
+
+    def __init__(self, directory=None, max_bytes=1 << 30):
+        """Create the cache directory if it does not exist.
+
+        :param str directory: ~/.cache/mcmder/results by default
+        :param int max_bytes: size budget of the directory
+        """
+        if directory is None:
+            directory = os.path.join(
+                os.path.expanduser('~'), '.cache', 'mcmder', 'results')
+        directory = os.path.expanduser(directory)
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key, suffix='.csv'):
+        return os.path.join(self.directory, key + suffix)
+
+    def _lookup(self, path, count_miss=True):
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += count_miss
+            return None
+        self.hits += 1
+        return path
+
+    def get(self, key):
+        """Return the path of the cached csv, or None.
+
+        :param str key: fingerprint of the result
+        :rtype: str
+        """
+        return self._lookup(self._path(key))
+
+    def get_frame(self, key):
+        """Return the cached pandas.DataFrame, or None.
+
+        A miss is not counted, since the csv is looked up next.
+        :param str key: fingerprint of the result
+        :rtype: pandas.DataFrame
+        """
+        path = self._lookup(self._path(key, '.pkl'), count_miss=False)
+        if path is None:
+            return None
+        import pandas
+        return pandas.read_pickle(path)
+
+    def new_file(self):
+        """Return a new file path in the cache directory to write a result."""
+        file_descriptor, path = tempfile.mkstemp(
+            suffix='.tmp', dir=self.directory)
+        os.close(file_descriptor)
+        return path
+
+    def put(self, key, path):
+        """Move the csv at path into the cache.
+
+        :param str key: fingerprint of the result
+        :param str path: csv file made by new_file
+        :return: path of the cached csv
+        :rtype: str
+        """
+        cached = self._path(key)
+        os.replace(path, cached)
+        self.evict(keep=cached)
+        return cached
+
+    def put_frame(self, key, dataframe):
+        """Cache the parsed pandas.DataFrame of a result.
+
+        :param str key: fingerprint of the result
+        :param pandas.DataFrame dataframe: parsed result
+        """
+        path = self.new_file()
+        dataframe.to_pickle(path)
+        cached = self._path(key, '.pkl')
+        os.replace(path, cached)
+        self.evict(keep=cached)
+
+    def invalidate(self, key):
+        """Remove a result.
+
+        :param str or Mcmder key: fingerprint of the result or Mcmder of it
+        """
+        if not isinstance(key, str):
+            key = key.cache_key
+        for suffix in ('.csv', '.pkl'):
+            try:
+                os.remove(self._path(key, suffix))
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        """Remove all the results."""
+        for name in os.listdir(self.directory):
+            os.remove(os.path.join(self.directory, name))
+
+    @property
+    def size(self):
+        return sum(os.path.getsize(os.path.join(self.directory, name))
+                   for name in os.listdir(self.directory))
+
+    def evict(self, keep=None):
+        """Remove the least recently used results over max_bytes.
+
+        :param str keep: path of a result not to remove
+        """
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if name.endswith('.tmp'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            total += stat.st_size
+            if os.path.join(self.directory, name) != keep:
+                entries.append((stat.st_mtime, stat.st_size, name))
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def __repr__(self):
+        return '<ResultCache %r hits=%d misses=%d>' % (
+            self.directory, self.hits, self.misses)
+
+
+class CachedPipeline(PipelineBase):
+    """A finished pipeline whose stdout is a cached csv."""
+
+    statement = None
+    returncode = 0
+
+    def __init__(self, path, output_file=None, stdout=True, header=True,
+                 compression=None):
+        """Copy the cached csv like M-Command would output it.
+
+        :param str path: cached csv
+        :param str output_file: file path to write
+        :param bool stdout: read the csv also from stdout
+        :param bool header: keep the header line
+        :param compression.Compression compression: compresses output_file
+          if its suffix tells so
+        """
+        if output_file is not None:
+            with open(path, 'rb') as cached, \
+                    open_output(output_file, compression) as output:
+                if not header:
+                    cached.readline()
+                shutil.copyfileobj(cached, output)
+        self.stdout = open(
+            path if stdout or output_file is None else os.devnull, 'rb')
+        if not header:
+            self.stdout.readline()
+
+    def wait(self):
+        return self.returncode
+
+    def check(self, output=None):
+        pass
+
+    def kill(self):
+        pass
+
+    def close(self):
+        self.stdout.close()
@@ -0,0 +1,170 @@
+"""Keep the intermediate stream of a chain on disk and resume from it."""
+import os
+import json
+import hashlib
+
+from .cache import fingerprint
+from .errors import McmderError
+from .executor import PipelineBase
+from .utils import split_stages, join_stages
+
+
+class Checkpoint(object):
+    """A file keeping the records between two commands of a chain.
+
+    Next to the file, path + '.json' records the fingerprint of the
+    commands before it and their inputs, and the size of the file. The
+    file is valid only while both match.
+    """
+
+    def __init__(self, stage, path=None):
+        """
+        :param int stage: number of commands before the checkpoint
+        :param str path: file to write, in ~/.cache/mcmder/checkpoints
+          by default
+        """
+        self.stage = stage
+        self.path = path
+
+    def file_for(self, prefix_args, input_data):
+        """Return the path of the file, naming it after the commands."""
+        if self.path is not None:
+            return self.path
+        directory = os.path.join(
+            os.path.expanduser('~'), '.cache', 'mcmder', 'checkpoints')
+        os.makedirs(directory, exist_ok=True)
+        name = ' '.join(prefix_args)
+        if not isinstance(input_data, str) and input_data is not None:
+            name += '\0DataFrame'
+        return os.path.join(
+            directory, hashlib.sha256(name.encode()).hexdigest() + '.csv')
+
+    def __repr__(self):
+        return '<Checkpoint after %d commands %r>' % (self.stage, self.path)
+
+
+def is_valid(path, key):
+    """Return True if the checkpoint file at path was written for key."""
+    try:
+        with open(path + '.json') as meta_file:
+            meta = json.load(meta_file)
+        return meta['key'] == key and os.path.getsize(path) == meta['size']
+    except (OSError, ValueError, KeyError):
+        return False
+
+
+def prune(path):
+    """Remove a checkpoint file and its record if they exist."""
+    for stale in (path, path + '.json', path + '.partial'):
+        try:
+            os.remove(stale)
+        except FileNotFoundError:
+            pass
+
+
+def plan(mcmd_args, input_data, inputs, checkpoints, float_format=None):
+    """Return how to run a chain from its latest valid checkpoint.
+
+    Stale checkpoints met on the way are pruned. Each checkpoint after the
+    one resumed from is written by mtee inserted at its place.
+    :param list mcmd_args: arguments of M-Command
+    :param str or pandas.DataFrame input_data: input of Mcmder
+    :param list inputs: DataFrame or Mcmder given as options
+    :param list checkpoints: Checkpoint of the chain in order
+    :param str float_format: format of floats of the DataFrames
+    :return: (arguments to run, True if resumed, Pending)
+    :rtype: tuple
+    """
+    stages = split_stages(mcmd_args)
+    if any(point.stage >= len(stages) for point in checkpoints):
+        raise McmderError('checkpoint() must be followed by a command.')
+    resumed = None
+    pending = []
+    for point in reversed(checkpoints):
+        prefix = join_stages(stages[:point.stage])
+        path = point.file_for(prefix, input_data)
+        key = fingerprint(prefix, input_data, inputs, float_format)
+        if is_valid(path, key):
+            resumed = (point, path)
+            break
+        prune(path)
+        pending.insert(0, (point, path, key))
+    start = 0
+    if resumed is not None:
+        point, path = resumed
+        start = point.stage
+        stages[start] = [stages[start][0], 'i=' + path] + stages[start][1:]
+    run = []
+    writes = []
+    for index in range(start, len(stages)):
+        for point, path, key in pending:
+            if point.stage == index:
+                run.append(['mtee', 'o=' + path + '.partial'])
+                writes.append((len(run) - 1, path, key))
+        run.append(stages[index])
+    return join_stages(run), resumed is not None, Pending(writes)
+
+
+class Pending(object):
+    """Checkpoint files being written by mtee of a running chain."""
+
+    def __init__(self, writes):
+        """
+        :param list writes: (index of the mtee command, path, key)
+        """
+        self.writes = writes
+
+    def shift(self, count):
+        """Count commands inserted before the chain, like a decompressor."""
+        self.writes = [(stage + count, path, key)
+                       for stage, path, key in self.writes]
+
+    def commit(self, returncodes=None):
+        """Keep the files written completely and remove the others.
+
+        A file is complete when mtee and all the commands before it
+        succeeded, even if a later command failed. A command whose status
+        is not known, as with the shell engine, counts as failed.
+        :param list returncodes: exit status of each command, or None if
+          every command succeeded
+        """
+        for stage, path, key in self.writes:
+            partial = path + '.partial'
+            if returncodes is None or len(returncodes) > stage and \
+                    all(code == 0 for code in returncodes[:stage + 1]):
+                os.replace(partial, path)
+                with open(path + '.json', 'w') as meta_file:
+                    json.dump({'key': key, 'size': os.path.getsize(path)},
+                              meta_file)
+            else:
+                prune(path)
+        self.writes = []
+
+    def discard(self):
+        """Remove the files of a chain which did not finish."""
+        for _, path, _ in self.writes:
+            prune(path)
+        self.writes = []
+
+
+class CheckpointPipeline(PipelineBase):
+    """A running Pipeline whose checkpoints are kept when it finishes."""
+
+    def __init__(self, pipeline, pending):
+        self._pipeline = pipeline
+        self._pending = pending
+
+    def __getattr__(self, name):
+        return getattr(self._pipeline, name)
+
+    def wait(self):
+        returncode = self._pipeline.wait()
+        self._pending.commit(self._pipeline.returncodes)
+        return returncode
+
+    def terminate(self):
+        self._pipeline.terminate()
+
+    def close(self):
+        self._pipeline.close()
+        self._pending.discard()
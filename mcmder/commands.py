@@ -0,0 +1,268 @@
+"""What mcmder knows about the behavior of each M-Command."""
+import re
+
+# Commands that handle each record by itself and keep the order of records.
+RECORD_WISE = frozenset([
+    'mcal', 'mchgnum', 'mchgstr', 'mcut', 'mfldname', 'mnullto', 'msed',
+    'msel', 'mselnum', 'mselstr', 'msetstr', 'mtonull',
+])
+
+# Commands that handle the records of each key k= by themselves and output
+# them sorted by the key unless -q is given. Running them on shards which
+# never split a key gives the same records as running them on all records.
+KEY_WISE = frozenset([
+    'mavg', 'mbest', 'mcommon', 'mcount', 'mjoin', 'mstats', 'msum',
+    'muniq',
+])
+
+# Commands that skip sorting their input on k= with -q. mjoin and the like
+# are not here, since their -q also assumes the reference file is sorted.
+PRESORTABLE = frozenset([
+    'maccum', 'mavg', 'mbest', 'mcount', 'mnumber', 'mstats', 'msum',
+    'muniq',
+])
+
+# Commands rewriting the values of their f= fields in place, unless -A adds
+# the results as new fields.
+REWRITING = frozenset(['mchgnum', 'mchgstr', 'mnullto', 'msed', 'mtonull'])
+
+
+def fields(value):
+    """Return field names of a field list option like 'a:x,b%nr'.
+
+    :param str value: value of f=, k= and the like
+    :rtype: list
+    """
+    return value.split(',') if value else []
+
+
+def fields_rewritten(name, options, flags):
+    """Return the input fields whose values the command rewrites.
+
+    :param str name: M-Command name
+    :param dict options: options of the command
+    :param list flags: flags of the command
+    :rtype: list
+    """
+    if name not in REWRITING or 'A' in flags:
+        return []
+    return [field.split(':', 1)[0] for field in fields(options.get('f'))]
+
+
+def skips_sort(name, options, sorted_key):
+    """Return True if the command can be told its input is sorted by k=.
+
+    :param str name: M-Command name
+    :param dict options: options of the command
+    :param list sorted_key: fields the input is sorted by, or None
+    :rtype: bool
+    """
+    key = fields(options.get('k'))
+    # s= asks for another order inside each key.
+    return bool(name in PRESORTABLE and key and sorted_key and
+                options.get('s') is None and
+                key == sorted_key[:len(key)])
+
+
+def sorted_key_after(name, options, flags, sorted_key):
+    """Return fields the output of the command is sorted by, or None.
+
+    :param str name: M-Command name
+    :param dict options: options of the command
+    :param list flags: flags of the command
+    :param list sorted_key: fields the input is sorted by, or None
+    :rtype: list
+    """
+    if name == 'msortf':
+        key = []
+        for field in fields(options.get('f')):
+            # M-Command sorts keys as strings in ascending order.
+            if '%' in field:
+                break
+            key.append(field)
+        return key or None
+    if name in KEY_WISE or name in PRESORTABLE:
+        return fields(options.get('k')) or None
+    if not sorted_key or name not in RECORD_WISE:
+        return None
+    if set(fields_rewritten(name, options, flags)) & set(sorted_key):
+        return None
+    if name in ('mselnum', 'mselstr') and options.get('k'):
+        # Records are selected for each key k=, and output sorted by it.
+        return None
+    if name == 'mcut' and 'r' in flags:
+        removed = set(fields(options.get('f')))
+        renames = dict((field, field) for field in sorted_key
+                       if field not in removed)
+    elif name == 'mcut':
+        renames = dict(field.split(':', 1) if ':' in field
+                       else (field, field)
+                       for field in fields(options.get('f')))
+    elif name == 'mfldname':
+        renames = dict((field, field) for field in sorted_key)
+        renames.update(field.split(':', 1)
+                       for field in fields(options.get('f')) if ':' in field)
+    else:
+        return sorted_key
+    key = []
+    for field in sorted_key:
+        if field not in renames:
+            break
+        key.append(renames[field])
+    return key or None
+
+
+# Commands outputting the f= fields as numbers computed over each key k=,
+# and the last record of the key for the other fields.
+AGGREGATES = frozenset(['mavg', 'msum'])
+
+# Commands keeping the fields and their values of the records they output.
+SCHEMA_KEEPING = frozenset([
+    'mbest', 'mfsort', 'msel', 'mselnum', 'mselrand', 'mselstr', 'msortf',
+    'mtee',
+])
+
+
+def schema_from_dtypes(dtypes):
+    """Return the schema of a csv written from pandas.DataFrame.
+
+    :param pandas.Series dtypes: dtypes of the dataframe
+    :rtype: list of tuple
+    """
+    kinds = {'i': 'int', 'u': 'int', 'f': 'float', 'O': 'str', 'U': 'str'}
+    return [(str(name), kinds.get(getattr(dtype, 'kind', None)))
+            for name, dtype in dtypes.items()]
+
+
+def schema_after(name, options, flags, schema):
+    """Return the fields the command outputs with their types, or None.
+
+    A schema is a list of (field, type) where type is 'str', 'int', 'float'
+    or None if unknown. Key fields of unknown type are 'str', as
+    M-Command compares keys as strings and they may have leading zeros.
+    :param str name: M-Command name
+    :param dict options: options of the command
+    :param list flags: flags of the command
+    :param list schema: schema of the input, or None
+    :rtype: list of tuple
+    """
+    if 'nfn' in flags or 'nfno' in flags:
+        return None
+    types = dict(schema or [])
+    key = fields(options.get('k'))
+    if name == 'mcut' and 'r' not in flags:
+        cut = []
+        for field in fields(options.get('f')):
+            old, new = field.split(':', 1) if ':' in field else (field, field)
+            cut.append((new, types.get(old)))
+        return cut or None
+    if schema is None:
+        return None
+    if name == 'mcut':
+        removed = set(fields(options.get('f')))
+        return [item for item in schema if item[0] not in removed]
+    if name == 'mfldname':
+        renames = dict(field.split(':', 1)
+                       for field in fields(options.get('f')) if ':' in field)
+        return [(renames.get(field, field), kind) for field, kind in schema]
+    if name in SCHEMA_KEEPING:
+        output = list(schema)
+    elif name in AGGREGATES:
+        renames = dict(field.split(':', 1) if ':' in field else (field, field)
+                       for field in fields(options.get('f')))
+        output = [(renames[field], 'float') if field in renames
+                  else (field, kind) for field, kind in schema]
+    elif name in ('mcount', 'mnumber') and options.get('a'):
+        output = schema + [(options['a'], 'int')]
+    elif name == 'muniq':
+        output = [(field, types.get(field)) for field in key]
+    elif name == 'mjoin':
+        output = schema + [
+            (field.split(':', 1)[-1], None)
+            for field in fields(options.get('f'))]
+    elif name == 'mcal' and options.get('a'):
+        output = schema + [(options['a'], None)]
+    else:
+        return None
+    return [(field, kind or 'str') if field in key else (field, kind)
+            for field, kind in output]
+
+
+# Options of each command listing the input fields it reads.
+_READ_OPTIONS = {
+    'mavg': ('k', 'f'), 'mbest': ('k', 's'), 'mcal': (), 'mcount': ('k',),
+    'mcut': ('f',), 'mfldname': ('f',), 'mjoin': ('k',), 'msel': (),
+    'mselnum': ('f', 'k'), 'mselstr': ('f', 'k'), 'msortf': ('f',),
+    'msum': ('k', 'f'), 'muniq': ('k',),
+}
+
+# Options holding an expression like '${a}+$s{b}'.
+_EXPRESSION_OPTIONS = {'mcal': 'c', 'msel': 'c'}
+
+# A field in an expression: ${a} for a number, $s{a} for a string and so on.
+_EXPRESSION_FIELD = re.compile(r'\$[a-z]?\{([^}]*)\}')
+
+
+def fields_read(name, options, flags):
+    """Return the input fields the command reads, or None if not known.
+
+    Expressions referring to other records or to fields by a wildcard are
+    not known.
+    :param str name: M-Command name
+    :param dict options: options of the command
+    :param list flags: flags of the command
+    :rtype: list
+    """
+    if name not in _READ_OPTIONS or 'nfn' in flags:
+        return None
+    read = []
+    for option in _READ_OPTIONS[name]:
+        for field in fields(options.get(option)):
+            read.append(field.split(':', 1)[0].split('%', 1)[0])
+    expression = options.get(_EXPRESSION_OPTIONS.get(name), '')
+    if _refers_to_others(expression):
+        return None
+    for field in _EXPRESSION_FIELD.findall(expression):
+        if '*' in field or '?' in field:
+            return None
+        read.append(field)
+    return [field for index, field in enumerate(read)
+            if field not in read[:index]]
+
+
+def handles_each_record(name, options):
+    """Return True if the command outputs each record from it alone.
+
+    Expressions referring to other records and mselstr and mselnum
+    selecting whole keys k= are not.
+    :param str name: M-Command name
+    :param dict options: options of the command
+    :rtype: bool
+    """
+    if name not in RECORD_WISE:
+        return False
+    if name in ('mselnum', 'mselstr') and options.get('k'):
+        return False
+    return not _refers_to_others(
+        options.get(_EXPRESSION_OPTIONS.get(name), ''))
+
+
+def _refers_to_others(expression):
+    """Return True if an expression uses records other than its own."""
+    return '#{' in expression or 'line(' in expression or \
+        'top(' in expression or 'bottom(' in expression
+
+
+def fields_added(name, options, flags):
+    """Return the fields the command adds to each record.
+
+    :param str name: M-Command name
+    :param dict options: options of the command
+    :param list flags: flags of the command
+    :rtype: list
+    """
+    if name == 'mjoin':
+        return [field.split(':', 1)[-1] for field in fields(options.get('f'))]
+    if name in ('mcal', 'mcount', 'mnumber') and options.get('a'):
+        return [options['a']]
+    return []
@@ -0,0 +1,235 @@
+"""Read and write csv compressed by gzip or zstd with external tools."""
+import os
+import shutil
+import tempfile
+import contextlib
+import subprocess
+
+from .errors import McmderError, McmdError
+from .utils import stage_options
+
+# Codec of a file by its suffix.
+SUFFIXES = {'.gz': 'gzip', '.zst': 'zstd'}
+
+# Tools of each codec, the multithreaded one first.
+TOOLS = {'gzip': ('pigz', 'gzip'), 'zstd': ('zstd',)}
+
+_DECOMPRESSORS = frozenset(tool for tools in TOOLS.values()
+                           for tool in tools)
+
+
+def codec_of(path):
+    """Return 'gzip' or 'zstd' if path is a compressed file, or else None.
+
+    :param str path: file path
+    :rtype: str
+    """
+    if not isinstance(path, str):
+        return None
+    return SUFFIXES.get(os.path.splitext(path)[1].lower())
+
+
+def input_path(stage):
+    """Return the file a command reads, or None.
+
+    :param list stage: arguments of a command, or of a decompressor
+    :rtype: str
+    """
+    if stage[0] in _DECOMPRESSORS:
+        # The file ends the decompressor, which may be followed by the
+        # rest of the statement run by the shell.
+        return stage[stage.index('|') - 1 if '|' in stage else -1]
+    return stage_options(stage).get('i')
+
+
+def open_output(path, compression=None):
+    """Open a file to write csv into, compressed if its suffix tells so.
+
+    :param str path: file path to write
+    :param Compression compression: level and threads of the compressor
+    :return: binary file, or CompressedWriter
+    """
+    if codec_of(path) is None:
+        return open(path, 'wb')
+    return (compression or Compression()).writer(path)
+
+
+class Compression(object):
+    """How files ending with .gz or .zst are read and written.
+
+    A compressed input is streamed into the first command by a
+    decompressor, and a compressed output is written by a compressor
+    reading stdout of the last one. pigz is used for gzip if installed,
+    and zstd compresses in threads by itself.
+    """
+
+    def __init__(self, level=None, threads=None):
+        """
+        :param int level: compression level, the default of the tool by
+          default
+        :param int threads: threads of the compressor, the CPU count by
+          default
+        """
+        self.level = level
+        self.threads = threads
+
+    def _tool(self, codec):
+        for tool in TOOLS[codec]:
+            if shutil.which(tool) is not None:
+                return tool
+        raise McmderError('%s is needed for .%s files.' % (
+            ' or '.join(TOOLS[codec]), 'gz' if codec == 'gzip' else 'zst'))
+
+    def _threads(self):
+        return str(self.threads or os.cpu_count() or 1)
+
+    def decompress_args(self, path):
+        """Return the command writing the decompressed file into stdout.
+
+        :param str path: compressed file
+        :rtype: list
+        """
+        tool = self._tool(codec_of(path))
+        if tool == 'zstd':
+            return ['zstd', '-dcq', '-T' + self._threads(), path]
+        if tool == 'pigz':
+            return ['pigz', '-dc', '-p', self._threads(), path]
+        return [tool, '-dc', path]
+
+    def compress_args(self, path):
+        """Return the command compressing stdin into stdout for path.
+
+        :param str path: compressed file to write
+        :rtype: list
+        """
+        tool = self._tool(codec_of(path))
+        level = [] if self.level is None else ['-%d' % self.level]
+        if tool == 'zstd':
+            if self.level is not None and self.level > 19:
+                level.insert(0, '--ultra')
+            return ['zstd', '-cq', '-T' + self._threads()] + level
+        if tool == 'pigz':
+            return ['pigz', '-c', '-p', self._threads()] + level
+        return [tool, '-c'] + level
+
+    def expand(self, stages):
+        """Return stages reading a compressed i= through a decompressor.
+
+        :param list stages: arguments of each command
+        :rtype: list
+        """
+        if not stages:
+            return stages
+        path = stage_options(stages[0]).get('i')
+        if codec_of(path) is None:
+            return stages
+        first = [arg for arg in stages[0] if arg != 'i=' + path]
+        return [self.decompress_args(path), first] + stages[1:]
+
+    def writer(self, path):
+        """Return CompressedWriter of path.
+
+        :param str path: compressed file to write
+        :rtype: CompressedWriter
+        """
+        return CompressedWriter(self.compress_args(path), path)
+
+    @contextlib.contextmanager
+    def open_input(self, path):
+        """Yield a binary stream of the file, decompressed if needed.
+
+        :param str path: file path to read
+        """
+        if codec_of(path) is None:
+            with open(path, 'rb') as csv_file:
+                yield csv_file
+            return
+        process = subprocess.Popen(
+            self.decompress_args(path), stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL, start_new_session=True)
+        try:
+            yield process.stdout
+        finally:
+            process.stdout.close()
+            if process.poll() is None:
+                process.kill()
+            process.wait()
+
+    def __repr__(self):
+        return '<Compression level=%r threads=%r>' % (
+            self.level, self.threads)
+
+
+class CompressedWriter(object):
+    """stdin of a compressor writing into a file.
+
+    It is given as stdout to the last command, or written into. close()
+    waits for the compressor and raises McmdError if it failed.
+    """
+
+    def __init__(self, args, path):
+        """Start the compressor.
+
+        :param list args: command compressing stdin into stdout
+        :param str path: file path to write
+        """
+        self.args = args
+        self.path = path
+        self.closed = False
+        self._stderr = tempfile.TemporaryFile()
+        with open(path, 'wb') as output:
+            try:
+                self.process = subprocess.Popen(
+                    args, stdin=subprocess.PIPE, stdout=output,
+                    stderr=self._stderr, start_new_session=True)
+            except BaseException:
+                self._stderr.close()
+                raise
+
+    def fileno(self):
+        return self.process.stdin.fileno()
+
+    def write(self, data):
+        return self.process.stdin.write(data)
+
+    def close(self):
+        """Wait for the compressor to write all it was given."""
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        returncode = self.process.wait()
+        self._stderr.seek(0)
+        stderr = self._stderr.read()
+        self._stderr.close()
+        if returncode != 0:
+            raise McmdError(returncode, ' '.join(self.args), stderr=stderr)
+
+    def kill(self):
+        """Stop the compressor, leaving the file incomplete."""
+        if self.closed:
+            return
+        self.closed = True
+        if self.process.poll() is None:
+            self.process.kill()
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        self.process.wait()
+        self._stderr.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.kill()
+
+    def __repr__(self):
+        return '<CompressedWriter %r>' % self.path
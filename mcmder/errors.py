@@ -10,24 +10,61 @@ class McmdError(McmderError):
     """Raised when run() is called with check=True and the process.
 
     returns a non-zero exit status.
+    When one command of a longer statement failed, cmd is the command,
+    stage is its index and statement is the whole statement.
     Attributes:
-      cmd, returncode, stderr, output
+      cmd, returncode, stderr, output, stage, statement
     """
 
-    def __init__(self, returncode, cmd, output=None, stderr=None):
+    def __init__(self, returncode, cmd, output=None, stderr=None,
+                 stage=None, statement=None):
         self.returncode = returncode
         self.cmd = cmd
         self.output = output
         self.stderr = stderr
+        self.stage = stage
+        self.statement = statement
 
     def __str__(self):
+        cmd = "'%s'" % self.cmd if self.stage is None else \
+            "'%s' (stage %d of '%s')" % (self.cmd, self.stage, self.statement)
         if self.returncode and self.returncode < 0:
             try:
-                return "Command '%s' died with %r.\n %s" % (
-                    self.cmd, signal.Signals(-self.returncode), self.stderr)
+                return "Command %s died with %r.\n %s" % (
+                    cmd, signal.Signals(-self.returncode), self.stderr)
             except ValueError:
-                return "Command '%s' died with unknown signal %d.\n %s" % (
-                    self.cmd, -self.returncode, self.stderr)
+                return "Command %s died with unknown signal %d.\n %s" % (
+                    cmd, -self.returncode, self.stderr)
         else:
-            return "Command '%s' returned non-zero exit status %d.\n %s" % (
-                self.cmd, self.returncode, self.stderr)
+            return "Command %s returned non-zero exit status %d.\n %s" % (
+                cmd, self.returncode, self.stderr)
+
+
+class McmdTimeout(McmderError):
+    """Raised when M-Command did not finish within the timeout.
+
+    Attributes:
+      cmd, timeout
+    """
+
+    def __init__(self, cmd, timeout):
+        self.cmd = cmd
+        self.timeout = timeout
+
+    def __str__(self):
+        return "Command '%s' timed out after %s seconds." % (
+            self.cmd, self.timeout)
+
+
+class McmdCancelled(McmderError):
+    """Raised when M-Command was cancelled before it finished.
+
+    Attributes:
+      cmd
+    """
+
+    def __init__(self, cmd):
+        self.cmd = cmd
+
+    def __str__(self):
+        return "Command '%s' was cancelled." % self.cmd
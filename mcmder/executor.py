@@ -0,0 +1,555 @@
+"""Run M-Command statements as child processes."""
+import os
+import signal
+import time
+import subprocess
+import tempfile
+import threading
+
+from .errors import McmdError
+from .profile import StageProfile
+from .utils import split_stages
+
+ENGINES = ('argv', 'shell')
+
+# Bytes a relay between profiled commands reads at once.
+_RELAY_SIZE = 1 << 16
+
+# Exit statuses of a statement killed because its stdout was closed;
+# the shell reports a signal of its last command as 128 + signal.
+_SIGPIPE_STATUSES = (-signal.SIGPIPE, 128 + signal.SIGPIPE)
+
+
+class PipelineBase(object):
+    """Methods shared by running pipelines.
+
+    Subclasses provide stdout, returncode, wait, check, kill and close.
+    """
+
+    def communicate(self):
+        """Read all of stdout and wait for the statement.
+
+        :return: stdout of the statement, or None if it is not piped
+        :rtype: bytes
+        """
+        output = self.stdout.read() if self.stdout is not None else None
+        if self.stdout is not None:
+            self.stdout.close()
+        self.wait()
+        return output
+
+    def finish(self, output=None):
+        """Wait for the statement and raise McmdError if it failed."""
+        self.wait()
+        self.check(output)
+
+    def abort(self):
+        """Stop reading stdout and wait for the statement.
+
+        McmdError is raised only if the statement failed for another reason
+        than its stdout being closed.
+        """
+        self.stdout.close()
+        if self.wait() not in _SIGPIPE_STATUSES:
+            self.check()
+
+    def terminate(self):
+        """Kill the statement without waiting for it.
+
+        Unlike kill, it may be called while another thread reads stdout.
+        """
+        self.kill()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.returncode is None:
+            self.kill()
+        self.close()
+
+
+class Pipeline(PipelineBase):
+    """A running M-Command statement.
+
+    With the 'argv' engine each command is a process of its own, connected
+    to the next one by an OS pipe without a shell, and the exit status of
+    each command is known. With the 'shell' engine the statement runs with
+    /bin/sh as before.
+    When input chunks are given, they are written to the first command's
+    stdin from a writer thread. The pipe blocks the writer while M-Command
+    is busy, so only a few chunks are held in memory at any time.
+    When profiled, each process is reaped with os.wait4 for its rusage, and
+    with the 'argv' engine the output of each command is relayed through a
+    thread that counts its bytes and rows.
+    Named inputs are written into their FIFOs while the statement runs,
+    and are released and removed with the pipeline, and so is the temp
+    space of the commands.
+    Each command runs in a process group of its own, so killing it kills
+    also the processes it started, like the commands run by the shell.
+    An output like a compressor gets stdout of the statement directly, or
+    a copy of it when stdout is also read.
+    """
+
+    def __init__(self, args, input_chunks=None, stdout=subprocess.PIPE,
+                 stdin=None, engine='argv', profile=None, named_inputs=None,
+                 temp_space=None, output=None):
+        """Start the statement.
+
+        :param list args: arguments of M-Command joined by '|'
+        :param iterable input_chunks: bytes written to stdin, or None
+        :param stdout: stdout of the statement, same as subprocess.Popen
+        :param stdin: stdin of the statement if input_chunks is None,
+          same as subprocess.Popen
+        :param str engine: 'argv' or 'shell'
+        :param profile.Profile profile: report to add StageProfile of
+          each process to
+        :param fifo.NamedInputs named_inputs: FIFOs given in args
+        :param resources.TempSpace temp_space: temp directory of the
+          commands, whose quota kills them
+        :param compression.CompressedWriter output: written stdout of the
+          statement, and closed when it finished. Give it also as stdout
+          unless stdout is read.
+        """
+        if engine not in ENGINES:
+            raise ValueError('engine must be one of %s.' % ', '.join(ENGINES))
+        self.named_inputs = named_inputs
+        self.temp_space = temp_space
+        self.output = output
+        self._env = temp_space.env if temp_space is not None else None
+        self.args = list(args)
+        self.statement = ' '.join(args)
+        self.stages = [self.args] if engine == 'shell' \
+            else split_stages(self.args)
+        self.processes = []
+        self.stage_profiles = []
+        self._stderrs = []
+        self._threads = []
+        self._stdout = None
+        self._writer = None
+        self._writer_error = None
+        self.input_bytes = 0
+        self.input_lines = 0
+        relay = profile is not None and engine == 'argv'
+        if input_chunks is not None:
+            stdin = subprocess.PIPE
+        try:
+            for index, stage in enumerate(self.stages):
+                self._stderrs.append(tempfile.TemporaryFile())
+                last = index == len(self.stages) - 1
+                if index == 0:
+                    stage_stdin = stdin
+                elif relay:
+                    stage_stdin = subprocess.PIPE
+                else:
+                    stage_stdin = self.processes[-1].stdout
+                self.processes.append(self._popen(
+                    stage, engine, stdin=stage_stdin,
+                    stdout=stdout if last else subprocess.PIPE,
+                    stderr=self._stderrs[-1]
+                ))
+                if profile is not None:
+                    self._profile(stage)
+                if index and relay:
+                    self._start(self._relay, self.processes[-2].stdout,
+                                self.processes[-1].stdin,
+                                self.stage_profiles[-2])
+                elif index:
+                    # Only the next command reads it now.
+                    self.processes[-2].stdout.close()
+            if relay and stdout == subprocess.PIPE:
+                read_fd, write_fd = os.pipe()
+                self._stdout = os.fdopen(read_fd, 'rb')
+                self._start(self._relay, self.processes[-1].stdout,
+                            os.fdopen(write_fd, 'wb'),
+                            self.stage_profiles[-1])
+            if output is not None and stdout == subprocess.PIPE:
+                read_fd, write_fd = os.pipe()
+                self._start(self._tee, self.stdout,
+                            os.fdopen(write_fd, 'wb'), output)
+                self._stdout = os.fdopen(read_fd, 'rb')
+        except BaseException:
+            for process in self.processes:
+                _kill_group(process.pid)
+                process.wait()
+            if output is not None:
+                output.kill()
+            if named_inputs is not None:
+                named_inputs.close()
+            if temp_space is not None:
+                temp_space.close()
+            raise
+        if profile is not None:
+            profile.stages.extend(self.stage_profiles)
+        if named_inputs is not None:
+            named_inputs.start()
+        if temp_space is not None:
+            temp_space.start(self.terminate)
+        if input_chunks is not None:
+            self._writer = threading.Thread(
+                target=self._write_input, args=(input_chunks,))
+            self._writer.daemon = True
+            self._writer.start()
+
+    def _start(self, target, *args):
+        thread = threading.Thread(target=target, args=args)
+        thread.daemon = True
+        thread.start()
+        self._threads.append(thread)
+
+    def _profile(self, stage):
+        process = self.processes[-1]
+        self.stage_profiles.append(StageProfile(' '.join(stage), process.pid))
+        self._start(self._reap, process, self.stage_profiles[-1], time.time())
+
+    @staticmethod
+    def _reap(process, stage_profile, started):
+        try:
+            _, status, rusage = os.wait4(process.pid, 0)
+        except ChildProcessError:
+            # Reaped by Popen while being killed; no rusage for it.
+            return
+        stage_profile.record(status, rusage, started)
+        process.returncode = stage_profile.returncode
+
+    @staticmethod
+    def _relay(source, target, stage_profile):
+        try:
+            for chunk in iter(lambda: source.read1(_RELAY_SIZE), b''):
+                stage_profile.count(chunk)
+                target.write(chunk)
+        except BrokenPipeError:
+            pass
+        finally:
+            source.close()
+            close_quietly(target)
+
+    @staticmethod
+    def _tee(source, target, output):
+        try:
+            for chunk in iter(lambda: source.read1(_RELAY_SIZE), b''):
+                output.write(chunk)
+                if target is not None:
+                    try:
+                        target.write(chunk)
+                    except BrokenPipeError:
+                        # stdout is not read anymore; keep the output.
+                        target = None
+        except BrokenPipeError:
+            # The output stopped; its exit status tells why.
+            pass
+        finally:
+            source.close()
+            if target is not None:
+                close_quietly(target)
+
+    def _popen(self, stage, engine, **kwargs):
+        if engine == 'shell':
+            return subprocess.Popen(' '.join(stage), shell=True,
+                                    env=self._env, start_new_session=True,
+                                    **kwargs)
+        try:
+            return subprocess.Popen(stage, env=self._env,
+                                    start_new_session=True, **kwargs)
+        except FileNotFoundError as error:
+            # Fail like the shell does for a command not found.
+            raise McmdError(127, ' '.join(stage), stderr=str(error).encode(),
+                            stage=len(self.processes),
+                            statement=self.statement)
+
+    def _write_input(self, input_chunks):
+        try:
+            for chunk in input_chunks:
+                self.stdin.write(chunk)
+                self.input_bytes += len(chunk)
+                self.input_lines += chunk.count(b'\n')
+        except BrokenPipeError:
+            # M-Command stopped reading; its exit status tells why.
+            pass
+        except Exception as error:
+            self._writer_error = error
+        finally:
+            close_quietly(self.stdin)
+
+    @property
+    def stdin(self):
+        return self.processes[0].stdin
+
+    @property
+    def stdout(self):
+        if self._stdout is not None:
+            return self._stdout
+        return self.processes[-1].stdout
+
+    @property
+    def pids(self):
+        """Process ids of the commands."""
+        return [process.pid for process in self.processes]
+
+    @property
+    def returncodes(self):
+        """Exit statuses of the commands, None for the running ones."""
+        return [process.returncode for process in self.processes]
+
+    @property
+    def failed_stage(self):
+        """Index of the first command that failed, or None.
+
+        A command killed by SIGPIPE only stopped because a later command
+        stopped reading, so it is not the one to blame.
+        """
+        for index, returncode in enumerate(self.returncodes):
+            if returncode not in (0, None) + _SIGPIPE_STATUSES:
+                return index
+        return None
+
+    @property
+    def returncode(self):
+        """Exit status of the failed command, or else of the last one."""
+        if None in self.returncodes:
+            return None
+        failed_stage = self.failed_stage
+        return self.returncodes[
+            -1 if failed_stage is None else failed_stage]
+
+    @property
+    def stderr(self):
+        return b''.join(self.stage_stderr(index)
+                        for index in range(len(self.stages)))
+
+    def stage_stderr(self, index):
+        """Return stderr of a command.
+
+        :param int index: index of the command
+        :rtype: bytes
+        """
+        self._stderrs[index].seek(0)
+        return self._stderrs[index].read()
+
+    def wait(self):
+        """Wait for the commands and the writer threads to finish.
+
+        :rtype: int
+        """
+        for thread in self._threads:
+            thread.join()
+        for process in self.processes:
+            process.wait()
+        if self._writer is not None:
+            self._writer.join()
+        if self.named_inputs is not None:
+            self.named_inputs.finish()
+        if self.temp_space is not None:
+            self.temp_space.finish()
+            if self.temp_space.error is not None:
+                raise self.temp_space.error
+        if self._writer_error is not None:
+            raise self._writer_error
+        if self.named_inputs is not None and \
+                self.named_inputs.error is not None:
+            raise self.named_inputs.error
+        if self.output is not None:
+            self.output.close()
+        return self.returncode
+
+    def kill(self):
+        """Kill the commands still running."""
+        if self._stdout is not None:
+            # Unblock the relay writing into it.
+            self._stdout.close()
+        self.terminate()
+        self.wait()
+
+    def terminate(self):
+        """Kill the process group of each command still running."""
+        for process in self.processes:
+            if process.poll() is None:
+                _kill_group(process.pid)
+
+    def check(self, output=None):
+        """Raise McmdError if the statement failed."""
+        if self.returncode == 0:
+            return
+        stage = self.failed_stage
+        if stage is None or len(self.stages) == 1:
+            raise McmdError(
+                self.returncode, self.statement,
+                output=output, stderr=self.stderr
+            )
+        raise McmdError(
+            self.returncode, ' '.join(self.stages[stage]), output=output,
+            stderr=self.stage_stderr(stage), stage=stage,
+            statement=self.statement
+        )
+
+    def close(self):
+        if self.stdout is not None:
+            self.stdout.close()
+        for stderr in self._stderrs:
+            stderr.close()
+        if self.output is not None:
+            self.output.kill()
+        if self.named_inputs is not None:
+            self.named_inputs.close()
+        if self.temp_space is not None:
+            self.temp_space.close()
+
+
+async def run_async(args, input_chunks=None, engine='argv',
+                    named_inputs=None, temp_space=None,
+                    stdout=subprocess.PIPE, output=None):
+    """Run M-Command on the event loop and return its stdout.
+
+    Each command runs in a new process group, and the groups are killed
+    when the coroutine is cancelled.
+    :param list args: arguments of M-Command joined by '|'
+    :param iterable input_chunks: bytes written to stdin, or None
+    :param str engine: 'argv' or 'shell'
+    :param fifo.NamedInputs named_inputs: FIFOs given in args, removed
+      when the statement finished
+    :param resources.TempSpace temp_space: temp directory of the
+      commands, removed when the statement finished
+    :param stdout: stdout of the statement, PIPE to return it
+    :param compression.CompressedWriter output: written stdout of the
+      statement, and closed when it finished
+    :return: stdout, or None if it is not piped
+    :rtype: bytes
+    """
+    # The event loop running this has imported asyncio already.
+    import asyncio
+    if engine not in ENGINES:
+        raise ValueError('engine must be one of %s.' % ', '.join(ENGINES))
+    if named_inputs is None and temp_space is None and output is None:
+        return await _run_async(args, input_chunks, engine, stdout=stdout)
+    loop = asyncio.get_event_loop()
+    if named_inputs is not None:
+        named_inputs.start()
+    try:
+        result = await _run_async(args, input_chunks, engine, temp_space,
+                                  stdout)
+        if output is not None:
+            if result is not None:
+                await loop.run_in_executor(None, output.write, result)
+            await loop.run_in_executor(None, output.close)
+    except McmdError:
+        # The commands were killed for the quota.
+        if temp_space is not None and temp_space.error is not None:
+            raise temp_space.error
+        raise
+    finally:
+        for resource in (named_inputs, temp_space):
+            if resource is not None:
+                await loop.run_in_executor(None, resource.close)
+        if output is not None:
+            await loop.run_in_executor(None, output.kill)
+    for resource in (temp_space, named_inputs):
+        if resource is not None and resource.error is not None:
+            raise resource.error
+    return result
+
+
+async def _run_async(args, input_chunks, engine, temp_space=None,
+                     stdout=subprocess.PIPE):
+    import asyncio
+    statement = ' '.join(args)
+    stages = [args] if engine == 'shell' else split_stages(args)
+    processes = []
+    try:
+        read_fd = subprocess.PIPE if input_chunks is not None else None
+        for index, stage in enumerate(stages):
+            last = index == len(stages) - 1
+            next_read_fd, write_fd = (None, stdout) if last else os.pipe()
+            kwargs = dict(stdin=read_fd, stdout=write_fd,
+                          stderr=subprocess.PIPE, start_new_session=True,
+                          env=temp_space.env if temp_space else None)
+            try:
+                if engine == 'shell':
+                    process = await asyncio.create_subprocess_shell(
+                        statement, **kwargs)
+                else:
+                    process = await asyncio.create_subprocess_exec(
+                        *stage, **kwargs)
+            except FileNotFoundError as error:
+                raise McmdError(
+                    127, ' '.join(stage), stderr=str(error).encode(),
+                    stage=index, statement=statement)
+            finally:
+                for fd in (read_fd, write_fd):
+                    if isinstance(fd, int) and fd >= 0:
+                        os.close(fd)
+            processes.append(process)
+            read_fd = next_read_fd
+        if temp_space is not None:
+            temp_space.start(lambda: _kill_groups(processes))
+        results = await asyncio.gather(
+            _read_async(processes[-1].stdout),
+            _feed_async(processes[0].stdin, input_chunks),
+            *[process.stderr.read() for process in processes]
+        )
+        returncodes = [await process.wait() for process in processes]
+    except BaseException:
+        for process in processes:
+            _kill_group(process.pid)
+        for process in processes:
+            await process.wait()
+        raise
+    output, stderrs = results[0], results[2:]
+    for index, returncode in enumerate(returncodes):
+        if returncode not in (0,) + _SIGPIPE_STATUSES:
+            break
+    else:
+        index = len(returncodes) - 1
+        if returncodes[index] == 0:
+            return output
+    if len(stages) == 1:
+        raise McmdError(returncodes[index], statement,
+                        output=output, stderr=stderrs[index])
+    raise McmdError(returncodes[index], ' '.join(stages[index]),
+                    output=output, stderr=stderrs[index], stage=index,
+                    statement=statement)
+
+
+async def _read_async(stdout):
+    if stdout is None:
+        return None
+    return await stdout.read()
+
+
+async def _feed_async(stdin, input_chunks):
+    if input_chunks is None:
+        return
+    import asyncio
+    loop = asyncio.get_event_loop()
+    chunks = iter(input_chunks)
+    try:
+        while True:
+            # Encoding a chunk is CPU work, keep it off the event loop.
+            chunk = await loop.run_in_executor(None, next, chunks, None)
+            if chunk is None:
+                break
+            stdin.write(chunk)
+            await stdin.drain()
+    except (BrokenPipeError, ConnectionResetError):
+        pass
+    finally:
+        stdin.close()
+
+
+def close_quietly(stream):
+    """Close a pipe whose reader may have already gone."""
+    try:
+        stream.close()
+    except BrokenPipeError:
+        pass
+
+
+def _kill_groups(processes):
+    for process in processes:
+        _kill_group(process.pid)
+
+
+def _kill_group(pid):
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
@@ -0,0 +1,115 @@
+"""Stream DataFrames and results of other chains to M-Command as files."""
+import os
+import shutil
+import tempfile
+import threading
+
+from .utils import DEFAULT_CHUNKSIZE, df2chunks, is_dataframe
+
+# Bytes copied from another chain into a FIFO at once.
+_COPY_SIZE = 1 << 16
+
+
+def placeholder(index):
+    """Return the file path given to M-Command until it is a FIFO.
+
+    :param int index: index of the input in the chain
+    :rtype: str
+    """
+    return '<input:%d>' % index
+
+
+class NamedInputs(object):
+    """FIFOs each of which a writer thread streams an input into.
+
+    M-Command opens a FIFO like a file, so options like m= read a
+    DataFrame or the output of another Mcmder without writing it to disk.
+    The FIFO is read only once, from the start to the end.
+    """
+
+    def __init__(self, sources, chunksize=DEFAULT_CHUNKSIZE,
+                 float_format=None):
+        """Make a FIFO for each source.
+
+        :param list sources: pandas.DataFrame or Mcmder of each placeholder
+        :param int chunksize: rows of a DataFrame written at once
+        :param str float_format: format of floats of a DataFrame
+        """
+        self.sources = list(sources)
+        self.chunksize = chunksize
+        self.float_format = float_format
+        self.error = None
+        self._threads = []
+        self._tmpdir = tempfile.mkdtemp(prefix='mcmder-')
+        self.paths = []
+        for index in range(len(self.sources)):
+            path = os.path.join(self._tmpdir, '%d.csv' % index)
+            os.mkfifo(path)
+            self.paths.append(path)
+
+    def resolve(self, args):
+        """Replace the placeholders in args by the paths of the FIFOs.
+
+        :param list args: arguments of M-Command
+        :rtype: list
+        """
+        resolved = []
+        for arg in args:
+            for index, path in enumerate(self.paths):
+                arg = arg.replace(placeholder(index), path)
+            resolved.append(arg)
+        return resolved
+
+    def start(self):
+        """Start writing the sources into the FIFOs."""
+        for source, path in zip(self.sources, self.paths):
+            thread = threading.Thread(target=self._write, args=(source, path))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _write(self, source, path):
+        try:
+            # Blocks until M-Command opens the FIFO.
+            with open(path, 'wb') as fifo:
+                if is_dataframe(source):
+                    for chunk in df2chunks(source, self.chunksize,
+                                           float_format=self.float_format):
+                        fifo.write(chunk)
+                else:
+                    self._copy(source, fifo)
+        except BrokenPipeError:
+            # M-Command stopped reading; its exit status tells why.
+            pass
+        except Exception as error:
+            self.error = error
+
+    @staticmethod
+    def _copy(mcmder, fifo):
+        with mcmder._open(stdout=True) as pipeline:
+            try:
+                for chunk in iter(
+                        lambda: pipeline.stdout.read1(_COPY_SIZE), b''):
+                    fifo.write(chunk)
+            except BrokenPipeError:
+                pipeline.abort()
+                raise
+            pipeline.finish()
+
+    def finish(self):
+        """Wait for the writers after M-Command exited.
+
+        A writer still waiting for M-Command to open its FIFO is released.
+        """
+        for path, thread in zip(self.paths, self._threads):
+            while thread.is_alive():
+                try:
+                    os.close(os.open(path, os.O_RDONLY | os.O_NONBLOCK))
+                except FileNotFoundError:
+                    pass
+                thread.join(0.05)
+
+    def close(self):
+        """Release the writers and remove the FIFOs."""
+        self.finish()
+        shutil.rmtree(self._tmpdir, ignore_errors=True)
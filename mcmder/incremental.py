@@ -0,0 +1,267 @@
+"""Aggregate only the records appended to a file since the last run."""
+import os
+import json
+import fcntl
+import hashlib
+import tempfile
+import itertools
+
+from .commands import handles_each_record, fields
+from .errors import McmderError
+from .executor import Pipeline
+from .utils import split_stages, join_stages, stage_options, stage_flags
+
+# Bytes of the input before the processed offset which must not change.
+_TAIL_SIZE = 1 << 12
+
+# Bytes of the input read at once.
+_READ_SIZE = 1 << 20
+
+# mstats statistics whose results merge by the same statistic.
+_MERGEABLE_STATS = frozenset(['max', 'min', 'sum'])
+
+# Significant digits of the kept aggregate, with which a double is read back
+# unchanged.
+_FULL_PRECISION = '17'
+
+
+def merge_stage(stage):
+    """Return the command merging results of stage, or None.
+
+    Results of msum and mcount are merged by summing them, those of muniq
+    by muniq, and those of mstats c=min, max or sum by the same mstats.
+    mavg is not supported, since averages of parts do not merge into the
+    average of the whole.
+    :param list stage: arguments of an aggregating command
+    :rtype: list
+    """
+    name = stage[0]
+    options = stage_options(stage)
+    key = options.get('k')
+    if not key:
+        return None
+    common = ['%s=%s' % (option, options[option])
+              for option in ('tmpPath', 'precision') if option in options]
+    outputs = ','.join(field.split(':', 1)[-1]
+                       for field in fields(options.get('f')))
+    if name == 'msum' and outputs:
+        return ['msum', 'f=' + outputs, 'k=' + key] + common
+    if name == 'mcount' and options.get('a'):
+        return ['msum', 'f=' + options['a'], 'k=' + key] + common
+    if name == 'muniq':
+        return ['muniq', 'k=' + key] + common
+    if name == 'mstats' and outputs and \
+            options.get('c') in _MERGEABLE_STATS:
+        return ['mstats', 'c=' + options['c'], 'f=' + outputs,
+                'k=' + key] + common
+    return None
+
+
+def default_directory(mcmd_args):
+    """Return the directory of the state of a chain in ~/.cache/mcmder.
+
+    :param list mcmd_args: arguments of M-Command
+    :rtype: str
+    """
+    return os.path.join(
+        os.path.expanduser('~'), '.cache', 'mcmder', 'incremental',
+        hashlib.sha256(' '.join(mcmd_args).encode()).hexdigest())
+
+
+class IncrementalState(object):
+    """Offset processed so far and the aggregate of the records before it.
+
+    The directory keeps state.json, aggregate.csv, which is computed with
+    full precision so that merges do not add up rounding errors, and
+    result.csv, which is the aggregate rounded as the chain asks. The
+    state is used only
+    while the input keeps its inode and the bytes just before the offset,
+    so a rewritten or truncated file is aggregated from the start again.
+    """
+
+    def __init__(self, directory):
+        """
+        :param str directory: directory to keep the state in
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.aggregate_path = os.path.join(directory, 'aggregate.csv')
+        self.result_path = os.path.join(directory, 'result.csv')
+        self.state_path = os.path.join(directory, 'state.json')
+
+    def update(self, mcmd_args, input_file, engine='argv', on_start=None):
+        """Aggregate the records appended since the last update.
+
+        :param list mcmd_args: commands each handling a record by itself
+          and an aggregating command at the end
+        :param str input_file: append-only csv with header
+        :param str engine: 'argv' or 'shell', see executor.Pipeline
+        :param callable on_start: called with each Pipeline started, to
+          kill it from another thread
+        :return: path of the csv of the aggregate of all the records
+        :rtype: str
+        """
+        stages = split_stages(mcmd_args)
+        merge = check_chain(stages)
+        # The input is given by stdin, from the offset.
+        stages[0] = [arg for arg in stages[0] if not arg.startswith('i=')]
+        stages[-1] = _full_precision(stages[-1])
+        key = hashlib.sha256(' '.join(
+            [os.path.abspath(input_file)] + join_stages(stages)).encode()
+        ).hexdigest()
+        with open(os.path.join(self.directory, 'lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            with open(input_file, 'rb') as csv_file:
+                header = csv_file.readline()
+                state = self._load(key, csv_file)
+                start = state['offset'] if state else len(header)
+                end = _last_line_end(csv_file, start)
+                if state and end == start:
+                    return self.result_path
+                chunks = _read_range(csv_file, header, start, end)
+                delta = self._run(join_stages(stages), chunks, engine,
+                                  on_start)
+                tail = _tail(csv_file, end)
+            if state:
+                try:
+                    merged = self._run(
+                        _full_precision(merge),
+                        _concat(self.aggregate_path, delta), engine, on_start)
+                finally:
+                    os.remove(delta)
+            else:
+                merged = delta
+            os.replace(merged, self.aggregate_path)
+            # Merging the aggregate alone rounds it.
+            os.replace(self._run(merge, _read(self.aggregate_path), engine,
+                                 on_start), self.result_path)
+            self._save({'key': key, 'offset': end, 'tail': tail,
+                        'inode': os.stat(input_file).st_ino})
+        return self.result_path
+
+    def _load(self, key, csv_file):
+        """Return the state if it is still valid for the input, or None."""
+        try:
+            with open(self.state_path) as state_file:
+                state = json.load(state_file)
+        except (OSError, ValueError):
+            return None
+        stat = os.fstat(csv_file.fileno())
+        if state.get('key') != key or state.get('inode') != stat.st_ino or \
+                state.get('offset', 0) > stat.st_size or \
+                not os.path.exists(self.aggregate_path) or \
+                not os.path.exists(self.result_path) or \
+                _tail(csv_file, state['offset']) != state.get('tail'):
+            return None
+        return state
+
+    def _save(self, state):
+        file_descriptor, path = tempfile.mkstemp(
+            suffix='.tmp', dir=self.directory)
+        with os.fdopen(file_descriptor, 'w') as state_file:
+            json.dump(state, state_file)
+        os.replace(path, self.state_path)
+
+    def _run(self, args, chunks, engine, on_start=None):
+        """Run args on chunks and return the path of the output."""
+        file_descriptor, path = tempfile.mkstemp(
+            suffix='.tmp', dir=self.directory)
+        try:
+            with os.fdopen(file_descriptor, 'wb') as output:
+                with Pipeline(args, chunks, stdout=output,
+                              engine=engine) as pipeline:
+                    if on_start is not None:
+                        on_start(pipeline)
+                    pipeline.finish()
+        except BaseException:
+            os.remove(path)
+            raise
+        return path
+
+    def clear(self):
+        """Forget the state, so that the next update starts over."""
+        for path in (self.state_path, self.aggregate_path, self.result_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def __repr__(self):
+        return '<IncrementalState %r>' % self.directory
+
+
+def check_chain(stages):
+    """Return the merging command of a chain, or raise McmderError.
+
+    :param list stages: arguments of each command
+    :rtype: list
+    """
+    for stage in stages[:-1]:
+        if not handles_each_record(stage[0], stage_options(stage)):
+            raise McmderError(
+                "incremental() cannot follow '%s', which does not handle "
+                "each record by itself." % ' '.join(stage))
+    if stages and 'nfn' in stage_flags(stages[0]):
+        raise McmderError('incremental() needs the input with header.')
+    merge = merge_stage(stages[-1]) if stages else None
+    if merge is None:
+        raise McmderError(
+            'incremental() needs msum, mcount, muniq or mstats c=min, max '
+            'or sum with k= at the end of the chain.')
+    return merge
+
+
+def _full_precision(stage):
+    """Return msum or mstats stage outputting full precision."""
+    if stage[0] not in ('msum', 'mstats'):
+        return stage
+    return [arg for arg in stage if not arg.startswith('precision=')] + \
+        ['precision=' + _FULL_PRECISION]
+
+
+def _tail(csv_file, offset):
+    csv_file.seek(max(offset - _TAIL_SIZE, 0))
+    return hashlib.sha256(
+        csv_file.read(offset - csv_file.tell())).hexdigest()
+
+
+def _last_line_end(csv_file, start):
+    """Return the offset after the last complete line, at least start.
+
+    A record being appended is left for the next update.
+    """
+    end = os.fstat(csv_file.fileno()).st_size
+    while end > start:
+        size = min(_READ_SIZE, end - start)
+        csv_file.seek(end - size)
+        newline = csv_file.read(size).rfind(b'\n')
+        if newline >= 0:
+            return end - size + newline + 1
+        end -= size
+    return start
+
+
+def _read_range(csv_file, header, start, end):
+    """Yield the header and the bytes from start to end."""
+    yield header
+    position = start
+    while position < end:
+        csv_file.seek(position)
+        chunk = csv_file.read(min(_READ_SIZE, end - position))
+        position += len(chunk)
+        yield chunk
+
+
+def _read(path, header=True):
+    """Yield the bytes of a csv, without the header line unless header."""
+    with open(path, 'rb') as csv_file:
+        if not header:
+            csv_file.readline()
+        for chunk in iter(lambda: csv_file.read(_READ_SIZE), b''):
+            yield chunk
+
+
+def _concat(aggregate_path, delta_path):
+    """Yield the previous aggregate and the records of the new one."""
+    return itertools.chain(_read(aggregate_path),
+                           _read(delta_path, header=False))
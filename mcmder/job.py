@@ -0,0 +1,263 @@
+"""Run M-Command in the background with a deadline and progress reports."""
+import os
+import time
+import threading
+
+from .compression import input_path
+from .errors import McmdTimeout, McmdCancelled
+
+
+class Progress(object):
+    """How much of the input M-Command has read.
+
+    Attributes:
+      done: bytes or lines read so far
+      total: bytes or lines of the input
+      unit: 'bytes' of a file input, or 'lines' of csv of a DataFrame
+        input, the header included
+      elapsed: seconds since the start
+    """
+
+    def __init__(self, done, total, unit, elapsed):
+        self.done = done
+        self.total = total
+        self.unit = unit
+        self.elapsed = elapsed
+
+    @property
+    def fraction(self):
+        """Fraction of the input read, from 0 to 1."""
+        return min(self.done / self.total, 1.0) if self.total else 1.0
+
+    @property
+    def eta(self):
+        """Estimated seconds to read the rest of the input, or None."""
+        if not self.done:
+            return None
+        return self.elapsed * max(self.total - self.done, 0) / self.done
+
+    def to_dict(self):
+        return {'done': self.done, 'total': self.total, 'unit': self.unit,
+                'fraction': self.fraction, 'elapsed': self.elapsed,
+                'eta': self.eta}
+
+    def __repr__(self):
+        return '<Progress %.1f%% of %d %s eta=%s>' % (
+            self.fraction * 100, self.total, self.unit, self.eta)
+
+
+def file_position(pid, path):
+    """Return the offset a process has read a file to, or None.
+
+    Read from /proc/<pid>/fdinfo on Linux, looking also into the children
+    of the process, like the commands run by the shell.
+    :param int pid: process id
+    :param str path: file the process reads
+    :rtype: int
+    """
+    path = os.path.realpath(path)
+    pids = [pid]
+    while pids:
+        pid = pids.pop(0)
+        fd_dir = '/proc/%d/fd' % pid
+        try:
+            fds = os.listdir(fd_dir)
+        except OSError:
+            continue
+        for fd in fds:
+            try:
+                if os.readlink(os.path.join(fd_dir, fd)) != path:
+                    continue
+                with open('/proc/%d/fdinfo/%s' % (pid, fd)) as fdinfo:
+                    for line in fdinfo:
+                        if line.startswith('pos:'):
+                            return int(line.split()[1])
+            except OSError:
+                continue
+        try:
+            with open('/proc/%d/task/%d/children' % (pid, pid)) as children:
+                pids.extend(int(child) for child in children.read().split())
+        except OSError:
+            pass
+    return None
+
+
+class Job(object):
+    """A running M-Command whose result is waited for later.
+
+    The whole process group of each command is killed by cancel() and on
+    the timeout. result() raises McmdTimeout or McmdCancelled then.
+    """
+
+    def __init__(self, pipeline, timeout=None, progress=None, interval=1.0,
+                 input_data=None, on_success=None, statement=None):
+        """Start reading the output of the pipeline in a thread.
+
+        :param executor.PipelineBase or callable pipeline: running pipeline,
+          or a callable opening it in the thread. The callable is given a
+          callable to call with each pipeline it runs before, like the one
+          filling a cache, so that they are killed as well
+        :param float timeout: seconds until the pipeline is killed
+        :param callable progress: called with Progress every interval
+          seconds, and once more when the pipeline finished
+        :param float interval: seconds between progress reports
+        :param str or pandas.DataFrame input_data: input of the chain,
+          for the total of the progress
+        :param callable on_success: called when the pipeline succeeded
+        :param str statement: statement of a pipeline opened by a callable
+        """
+        if callable(pipeline):
+            self.pipeline, self._open = None, pipeline
+        else:
+            self.pipeline, self._open = pipeline, None
+            statement = pipeline.statement
+        self.statement = statement
+        self.timeout = timeout
+        self.output = None
+        self.error = None
+        self._input_data = input_data
+        self._on_success = on_success
+        self._started = time.time()
+        self._done = threading.Event()
+        self._ended = threading.Event()
+        self._monitor_thread = None
+        self._lock = threading.Lock()
+        self._finished = False
+        self._stopped = None
+        self._running = self.pipeline
+        self._timer = None
+        if timeout is not None:
+            self._timer = threading.Timer(timeout, self._stop, (McmdTimeout(
+                statement, timeout),))
+            self._timer.daemon = True
+            self._timer.start()
+        if progress is not None:
+            self._monitor_thread = threading.Thread(
+                target=self._monitor, args=(progress, interval))
+            self._monitor_thread.daemon = True
+            self._monitor_thread.start()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        try:
+            if self._open is not None:
+                self.pipeline = self._open(self._track)
+                self._track(self.pipeline)
+            with self.pipeline as pipeline:
+                output = pipeline.communicate()
+                with self._lock:
+                    self._finished = True
+                if self._stopped is None:
+                    pipeline.check(output)
+                    self.output = output
+            if self._stopped is None and self._on_success is not None:
+                self._on_success()
+        except BaseException as error:
+            self.error = error
+        finally:
+            if self._timer is not None:
+                self._timer.cancel()
+            if self._stopped is not None:
+                self.error = self._stopped
+            self._ended.set()
+            if self._monitor_thread is not None:
+                # The last report is made before result() returns.
+                self._monitor_thread.join()
+            self._done.set()
+
+    def _monitor(self, progress, interval):
+        while not self._ended.wait(interval):
+            report = self.progress()
+            if report is not None:
+                progress(report)
+        report = self.progress()
+        if report is not None and self.error is None:
+            report.done = report.total
+            progress(report)
+
+    def _track(self, pipeline):
+        """Make pipeline the one killed by cancel() and the timeout."""
+        with self._lock:
+            self._running = pipeline
+            stopped = self._stopped is not None
+        if stopped:
+            pipeline.terminate()
+
+    def _stop(self, error):
+        with self._lock:
+            if self._finished or self._stopped is not None:
+                return
+            self._stopped = error
+            running = self._running
+        if running is not None:
+            running.terminate()
+
+    def progress(self):
+        """Return Progress of reading the input, or None if not known.
+
+        :rtype: Progress
+        """
+        elapsed = time.time() - self._started
+        input_data = self._input_data
+        if input_data is not None and not isinstance(input_data, str):
+            lines = getattr(self._running, 'input_lines', None)
+            if lines is None:
+                return None
+            return Progress(lines, len(input_data) + 1, 'lines', elapsed)
+        stages = getattr(self._running, 'stages', None)
+        pids = getattr(self._running, 'pids', None)
+        if not stages or not pids:
+            return None
+        path = input_path(stages[0])
+        if path is None or ',' in path:
+            return None
+        try:
+            total = os.path.getsize(path)
+        except OSError:
+            return None
+        position = file_position(pids[0], path)
+        if position is None:
+            if not self._ended.is_set():
+                return None
+            position = total
+        return Progress(position, total, 'bytes', elapsed)
+
+    def cancel(self):
+        """Kill the pipeline; result() then raises McmdCancelled."""
+        self._stop(McmdCancelled(self.statement))
+
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """Wait for the pipeline to finish.
+
+        :param float timeout: seconds to wait
+        :return: True if finished
+        :rtype: bool
+        """
+        return self._done.wait(timeout)
+
+    def result(self, timeout=None):
+        """Return the output after the pipeline finished.
+
+        Interrupting the wait, like by KeyboardInterrupt, cancels the job.
+        :param float timeout: seconds to wait, raising McmdTimeout after it
+        :rtype: bytes
+        """
+        try:
+            finished = self._done.wait(timeout)
+        except BaseException:
+            self.cancel()
+            raise
+        if not finished:
+            raise McmdTimeout(self.statement, timeout)
+        if self.error is not None:
+            raise self.error
+        return self.output
+
+    def __repr__(self):
+        state = 'done' if self.done() else 'running'
+        return '<Job %r %s>' % (self.statement, state)
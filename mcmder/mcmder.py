@@ -1,37 +1,192 @@
 """Use M-Command from python."""
 import os
 import io
+import csv
 import copy
+import time
 import subprocess
-import pandas
 
-from .errors import McmderError, McmdError
-from .utils import df2bytes, clean_dic
+from .errors import McmderError
+from . import bulk
+from . import plan
+from .cache import CachedPipeline, fingerprint
+from .checkpoint import Checkpoint, CheckpointPipeline, plan as resume_plan
+from .commands import (RECORD_WISE, KEY_WISE, skips_sort, fields_rewritten,
+                       handles_each_record, sorted_key_after,
+                       schema_from_dtypes, schema_after)
+from .compression import Compression, codec_of
+from .executor import Pipeline, run_async
+from .fifo import NamedInputs, placeholder
+from .incremental import IncrementalState, check_chain, default_directory
+from .job import Job
+from .optimizer import optimize, format_plan
+from .parallel import PartitionedPipeline
+from .profile import Profile
+from .reader import read_result, schema_from_file, dtypes_of
+from .registry import INFO_FLAGS, default_registry
+from .utils import (DEFAULT_CHUNKSIZE, df2chunks, clean_dic, to_cstr,
+                    split_stages, join_stages, stage_options, stage_flags,
+                    is_dataframe)
 
 
 class Mcmder(object):
     """Create/Contain M-Command and contain the result as pandas.DataFrame."""
 
-    def __init__(self, input_data=None, header=True, *, _mcmd_args=None):
+    def __init__(self, input_data=None, header=True, *,
+                 chunksize=DEFAULT_CHUNKSIZE, float_format=None, dtype=None,
+                 parser=None, cache=None, engine='argv', profile=False,
+                 validate=True, resources=None, compression=None,
+                 optimize=False, _mcmd_args=None):
         """Check if input data is file path or pandas.df.
 
         :param str or pandas.DataFrame input_data:
+        :param int chunksize: rows of a DataFrame input written to stdin at once
+        :param str float_format: format of floats of a DataFrame input like
+          '%.6f', see utils.df2chunks
+        :param dict dtype: dtypes to read some fields of the result, which
+          override the types known from the chain
+        :param str parser: engine of pandas.read_csv to read the result like
+          'pyarrow', which parses in several threads
+        :param cache.ResultCache cache: cache of results to look up first
+        :param str engine: 'argv' runs each command as a process connected by
+          pipes, 'shell' runs the statement with /bin/sh
+        :param bool or callable profile: keep profile.Profile of each
+          execution in last_profile, and call it with the report if callable
+        :param bool validate: check the parameters of each command against
+          what the installed command takes, see registry.ParamRegistry
+        :param resources.ResourcePolicy resources: tunes msortf and gives
+          each execution a temp directory of its own
+        :param compression.Compression compression: level and threads of
+          the tools reading and writing files ending with .gz or .zst
+        :param bool optimize: execute the chain rewritten by
+          optimizer.optimize, see explain()
         :param list _mcmd_args:
         """
         if not (input_data is None or isinstance(input_data, str) or
-                isinstance(input_data, pandas.DataFrame)):
+                is_dataframe(input_data)):
             raise ValueError('Input data must be str(file path) or pandas.DataFrame.')
         elif isinstance(input_data, str) and not os.path.exists(input_data):
             raise ValueError('Input file does not exist.')
         self.input_data = input_data
         self._mcmd_args = _mcmd_args
         self.header = header
+        self.chunksize = chunksize
+        self.float_format = float_format
+        self.dtype = dtype
+        self.parser = parser
+        self.cache = cache
+        self.engine = engine
+        self.sorted_key = None
+        self.compression = compression if compression is not None \
+            else Compression()
+        self._input_header = header
+        self.optimize = optimize
+        self.profile = profile
+        self.validate = validate
+        self.resources = resources
+        self.last_profile = None
+        self._parallel = None
+        self._inputs = []
+        self._checkpoints = []
+        self._incremental = None
         self._dataframe = None
 
+    @classmethod
+    def map_files(cls, files, pipeline_fn, workers=None, output=None,
+                  reduce=None, header=True, output_dir=None, **kwargs):
+        """Run the chain made by pipeline_fn over each file in parallel.
+
+        Failures are recorded for each file instead of stopping the others.
+        >>> Mcmder.map_files('logs/*.csv', lambda m: m.msum(f='amt', k='user'),
+        ...                  output='total.csv',
+        ...                  reduce=lambda m: m.msum(f='amt', k='user'))
+        :param str or list files: glob pattern or list of file paths
+        :param callable pipeline_fn: takes Mcmder of a file and returns Mcmder
+        :param int workers: number of files run at once, cpu count by default
+        :param str output: file path to write the concatenated results
+        :param callable reduce: takes Mcmder of the concatenated results and
+          returns Mcmder to write into output instead
+        :param bool header: input files have header, and so do their results
+        :param str output_dir: directory for the result of each file
+        :param kwargs: keyword arguments of each Mcmder, like engine,
+          compression or validate
+        :rtype: bulk.MapResult
+        """
+        return bulk.map_files(cls, files, pipeline_fn, workers, output,
+                              reduce, header, output_dir, **kwargs)
+
+    @staticmethod
+    def materialize_all(mcmders, outputs=None):
+        """Execute mcmders of the same input, sharing their first commands.
+
+        The commands all the chains start with run only once, and their
+        output is fanned out to the rest of each chain. Mcmders with a
+        cache, profile or checkpoints are executed one by one as usual.
+        >>> joined = Mcmder('a.csv').mjoin(k='id', m='b.csv', f='x').msortf(f='id')
+        >>> Mcmder.materialize_all([joined.msum(f='x', k='id'),
+        ...                         joined.mcount(a='n', k='id')])
+        :param list mcmders: list of Mcmder
+        :param list outputs: file path to write for each mcmder, or None to
+          get each result as pandas.DataFrame
+        :return: list of pandas.DataFrame, or outputs
+        """
+        return plan.materialize_all(mcmders, outputs)
+
     @property
     def statement(self):
         return ' '.join(self._mcmd_args) if self._mcmd_args else None
 
+    @property
+    def schema(self):
+        """Fields of the result and their types known from the chain.
+
+        The header of an input file is read each time, not when the chain
+        is built.
+        :rtype: list of tuple
+        """
+        schema = self._input_schema()
+        for stage in split_stages(self._mcmd_args or []):
+            schema = schema_after(stage[0], stage_options(stage),
+                                  stage_flags(stage), schema)
+        return schema
+
+    def _input_schema(self):
+        """Return the schema of the input DataFrame or file, or None."""
+        if is_dataframe(self.input_data):
+            return schema_from_dtypes(self.input_data.dtypes)
+        if isinstance(self.input_data, str) and self._input_header:
+            return schema_from_file(self.input_data, self.compression)
+        return None
+
+    def explain(self):
+        """Return the commands as built and as rewritten by the optimizer.
+
+        The rewritten ones are executed if optimize is True.
+        >>> print(Mcmder('a.csv').mcut(f='a,b,c').mcut(f='a:x,b').explain())
+        :rtype: str
+        """
+        if self._mcmd_args is None:
+            raise McmderError("This mcmder does not have commands yet.")
+        stages = split_stages(self._mcmd_args)
+        optimized, notes = optimize(stages, self._input_schema())
+        lines = ['Built (%d commands):' % len(stages), format_plan(stages),
+                 'Optimized (%d commands)%s:' % (
+                     len(optimized), '' if self.optimize and
+                     not self._checkpoints else ', not executed'),
+                 format_plan(optimized)]
+        if notes:
+            lines.append('Rewrites:')
+            lines.extend('  ' + note for note in notes)
+        return '\n'.join(lines)
+
+    @property
+    def cache_key(self):
+        """Fingerprint of the statement and its input files or DataFrame."""
+        if self._mcmd_args is None:
+            raise McmderError("This mcmder does not have commands yet.")
+        return fingerprint(self._mcmd_args, self.input_data, self._inputs,
+                           self.float_format)
+
     def save(self, output_file, create_dataframe=False):
         """Save data as a csv.
 
@@ -41,67 +196,462 @@ class Mcmder(object):
         if self._dataframe is not None:
             self._dataframe.to_csv(output_file)
         elif create_dataframe:
-            self._dataframe = pandas.read_csv(
-                io.BytesIO(self.execute(output_file, stdout=True)))
+            self._dataframe = self._read_stdout(self._parse, output_file)
         else:
             self.execute(output_file)
         return self
 
     @property
     def dataframe(self):
-        if self._dataframe is None:
-            self._dataframe = pandas.read_csv(
-                io.BytesIO(self.execute(stdout=True)))
+        if self._dataframe is None and self.cache is not None and \
+                self.dtype is None and self.parser is None:
+            # The frame is kept only as parsed without dtype and parser,
+            # which the key does not tell. Others parse the cached csv.
+            key = self.cache_key
+            self._dataframe = self.cache.get_frame(key)
+            if self._dataframe is None:
+                self._dataframe = self._read_stdout(self._parse)
+                self.cache.put_frame(key, self._dataframe)
+        elif self._dataframe is None:
+            self._dataframe = self._read_stdout(self._parse)
         return self._dataframe
 
     df = dataframe
 
-    def execute(self, output_file=None, stdout=False, header=False):
+    def read(self, output='pandas', dtype=None, parser=None):
+        """Execute M-Command and return the result in the given form.
+
+        Columns are read with the types known from the chain, like sums
+        of msum as floats and keys as str, unless dtype tells otherwise.
+        >>> Mcmder('a.csv').msum(f='amt', k='id').read('arrow')
+        :param str output: 'pandas' for pandas.DataFrame, 'arrow' for
+          pyarrow.Table or 'numpy' for numpy.recarray
+        :param dict dtype: overrides dtype of this mcmder
+        :param str parser: overrides parser of this mcmder
+        """
+        return self._read_stdout(lambda stdout: self._parse(
+            stdout, output, dtype, parser))
+
+    def _parse(self, stream, output='pandas', dtype=None, parser=None):
+        dtypes = dict(self.dtype or {})
+        dtypes.update(dtype or {})
+        return read_result(stream, self.schema, dtypes,
+                           parser or self.parser, output)
+
+    def iter_chunks(self, chunksize=io.DEFAULT_BUFFER_SIZE):
+        """Yield the csv output as bytes while M-Command is running.
+
+        :param int chunksize: maximum bytes of each chunk
+        :rtype: generator of bytes
+        """
+        return self._iter_stdout(
+            lambda stdout: iter(lambda: stdout.read1(chunksize), b''))
+
+    def iter_dataframes(self, rows=DEFAULT_CHUNKSIZE):
+        """Yield the output as pandas.DataFrame of the given rows.
+
+        :param int rows: rows of each dataframe
+        :rtype: generator of pandas.DataFrame
+        """
+        import pandas
+        return self._iter_stdout(
+            lambda stdout: pandas.read_csv(
+                stdout, chunksize=rows,
+                dtype=dtypes_of(self.schema, self.dtype) or None))
+
+    def iter_rows(self):
+        """Yield each record of the output as a list of str.
+
+        The header comes first, as it is in the csv.
+        :rtype: generator of list
+        """
+        return self._iter_stdout(lambda stdout: csv.reader(
+            io.TextIOWrapper(stdout, encoding='utf-8', newline='')))
+
+    def execute(self, output_file=None, stdout=False, header=False,
+                profile=None, timeout=None, progress=None):
         """Execute M-Command.
 
         if output_file is not None, just write into the file.
         :param str output_file: file path to write
         :param bool stdout: get bytes stdout
+        :param bool or callable profile: overrides profile of this mcmder
+        :param float timeout: seconds until M-Command is killed, raising
+          McmdTimeout
+        :param callable progress: called with job.Progress every second
+        :rtype: bytes
+        """
+        if timeout is not None or progress is not None:
+            return self.start(output_file, stdout, header, profile,
+                              timeout, progress).result()
+        report = self._new_profile(profile)
+        with self._open(output_file, stdout, header, report) as pipeline:
+            output = pipeline.communicate()
+            pipeline.check(output)
+        self._finish_profile(report)
+        return output
+
+    def start(self, output_file=None, stdout=False, header=False,
+              profile=None, timeout=None, progress=None, interval=1.0):
+        """Start M-Command in the background.
+
+        Job.cancel() kills all the processes of M-Command, and
+        Job.result() returns what execute() would.
+        :param str output_file: file path to write
+        :param bool stdout: get bytes stdout
+        :param bool or callable profile: overrides profile of this mcmder
+        :param float timeout: seconds until M-Command is killed, raising
+          McmdTimeout
+        :param callable progress: called with job.Progress of reading the
+          input every interval seconds
+        :param float interval: seconds between progress reports
+        :rtype: job.Job
+        """
+        report = self._new_profile(profile)
+        # A cache miss and an incremental update run in the job as well.
+        return Job(lambda on_start: self._open(
+            output_file, stdout, header, report, on_start),
+            timeout, progress, interval, input_data=self.input_data,
+            on_success=lambda: self._finish_profile(report),
+            statement=self.statement)
+
+    def _new_profile(self, profile=None):
+        """Return a new profile.Profile if profiling, or else None."""
+        profile = self.profile if profile is None else profile
+        if not profile:
+            return None
+        return Profile(self.statement,
+                       hook=profile if callable(profile) else None)
+
+    def _finish_profile(self, report):
+        if report is not None:
+            self.last_profile = report
+            report.finish()
+
+    async def aexecute(self, output_file=None, stdout=False, header=False):
+        """Execute M-Command on the running asyncio event loop.
+
+        Cancelling the task kills all the processes of M-Command.
+        :param str output_file: file path to write
+        :param bool stdout: get bytes stdout
         :rtype: bytes
         """
+        import asyncio
+        loop = asyncio.get_event_loop()
+        if self._incremental is not None:
+            path = await loop.run_in_executor(None, self._update_incremental)
+            return await loop.run_in_executor(
+                None, self._read_cached, path, output_file, stdout, header)
+        if self.cache is None:
+            return await self._run_async(output_file, stdout, header)
+        key = self.cache_key
+        path = self.cache.get(key)
+        if path is None:
+            new_file = self.cache.new_file()
+            try:
+                await self._run_async(new_file)
+            except BaseException:
+                os.remove(new_file)
+                raise
+            path = self.cache.put(key, new_file)
+        # Copying and reading the cached csv would block the event loop.
+        return await loop.run_in_executor(
+            None, self._read_cached, path, output_file, stdout, header)
+
+    def _read_cached(self, path, output_file=None, stdout=False,
+                     header=False):
+        """Return the output of a cached csv, as execute would."""
+        with CachedPipeline(path, output_file, stdout, not header,
+                            self.compression) as pipeline:
+            return pipeline.communicate()
+
+    async def _run_async(self, output_file=None, stdout=False, header=False):
+        args, kwargs, pending = self._prepare(output_file, stdout, header)
+        try:
+            output = await run_async(args, engine=self.engine, **kwargs)
+        except BaseException:
+            if pending is not None:
+                pending.discard()
+            raise
+        if pending is not None:
+            pending.commit()
+        return output
+
+    async def adataframe(self):
+        """Return the result as pandas.DataFrame like dataframe, in asyncio."""
+        import asyncio
+        if self._dataframe is None:
+            output = await self.aexecute(stdout=True)
+            self._dataframe = await asyncio.get_event_loop().run_in_executor(
+                None, self._parse, io.BytesIO(output))
+        return self._dataframe
+
+    async def asave(self, output_file, create_dataframe=False):
+        """Save data as a csv like save, in asyncio.
+
+        :param str output_file: file path to write
+        :param bool create_dataframe: save also as a dataframe
+        """
+        import asyncio
+        if self._dataframe is not None:
+            self._dataframe.to_csv(output_file)
+        elif create_dataframe:
+            output = await self.aexecute(output_file, stdout=True)
+            self._dataframe = await asyncio.get_event_loop().run_in_executor(
+                None, self._parse, io.BytesIO(output))
+        else:
+            await self.aexecute(output_file)
+        return self
+
+    def _open(self, output_file=None, stdout=False, header=False,
+              profile=None, on_start=None):
+        """Start M-Command and return the running Pipeline.
+
+        :param callable on_start: called with each pipeline run to the end
+          before the one returned, like on a cache miss
+        """
+        if self._incremental is not None:
+            return CachedPipeline(self._update_incremental(on_start),
+                                  output_file, stdout, not header,
+                                  self.compression)
+        if self.cache is not None:
+            return self._open_cached(output_file, stdout, header, profile,
+                                     on_start)
+        return self._start(output_file, stdout, header, profile)
+
+    def _open_cached(self, output_file, stdout, header, profile=None,
+                     on_start=None):
+        """Return the cached result, executing M-Command on a miss."""
+        key = self.cache_key
+        path = self.cache.get(key)
+        if path is not None and profile is not None:
+            profile.cached = True
+        if path is None:
+            new_file = self.cache.new_file()
+            try:
+                with self._start(new_file, profile=profile) as pipeline:
+                    if on_start is not None:
+                        on_start(pipeline)
+                    pipeline.communicate()
+                    pipeline.check()
+            except BaseException:
+                os.remove(new_file)
+                raise
+            path = self.cache.put(key, new_file)
+        return CachedPipeline(path, output_file, stdout, not header,
+                              self.compression)
+
+    def _update_incremental(self, on_start=None):
+        return self._incremental.update(
+            self._mcmd_args, self.input_data, self.engine, on_start)
+
+    def _start(self, output_file=None, stdout=False, header=False,
+               profile=None):
+        """Start M-Command without looking up the cache."""
+        plan = self._partition_plan()
+        if plan is not None:
+            return self._open_partitioned(
+                plan, output_file, stdout, header, profile)
+        args, kwargs, pending = self._prepare(
+            output_file, stdout, header, profile)
+        pipeline = Pipeline(args, engine=self.engine, profile=profile,
+                            **kwargs)
+        if pending is not None:
+            return CheckpointPipeline(pipeline, pending)
+        return pipeline
+
+    def _partition_plan(self):
+        """Return how to run the chain partitioned by parallel().
+
+        :return: (source stages, shard stages, merge key), or None if the
+          chain must run serially
+        """
+        if self._parallel is None or self._inputs or self._checkpoints:
+            # Shards cannot share a FIFO of another input, nor write a
+            # checkpoint of all the records.
+            return None
+        n, key, index = self._parallel
+        stages = split_stages(self._mcmd_args)
+        shard_stages = stages[index:]
+        if not shard_stages or shard_stages[-1][0] not in KEY_WISE or \
+                any('nfn' in stage_flags(stage) for stage in stages):
+            return None
+        for stage in shard_stages:
+            options, flags = stage_options(stage), stage_flags(stage)
+            if set(key) & set(fields_rewritten(stage[0], options, flags)):
+                # Records of a rewritten key would be in other shards.
+                return None
+            if handles_each_record(stage[0], options):
+                continue
+            if 'N' in flags:
+                # mjoin -N outputs the unmatched records of the reference
+                # file, which every shard would output.
+                return None
+            stage_key = options.get('k', '')
+            if stage[0] not in KEY_WISE | RECORD_WISE or '%' in stage_key or \
+                    not set(key) <= set(stage_key.split(',')):
+                return None
+        if index == 0:
+            shard_stages[0] = [arg for arg in shard_stages[0]
+                               if not arg.startswith('i=')]
+        merge_key = stage_options(shard_stages[-1])['k'].split(',')
+        return stages[:index], shard_stages, merge_key
+
+    def _open_partitioned(self, plan, output_file, stdout, header,
+                          profile=None):
+        source_stages, shard_stages, merge_key = plan
+        n, key, _ = self._parallel
+        if self.resources is not None:
+            # The n shards sort at once, sharing the memory.
+            tuned = self.resources.tune(source_stages + shard_stages * n,
+                                        self.input_data)
+            shard_stages = tuned[len(source_stages):
+                                 len(source_stages) + len(shard_stages)]
+            source_stages = tuned[:len(source_stages)]
+        input_file = self.input_data if not source_stages and \
+            isinstance(self.input_data, str) else None
+        if source_stages:
+            source_stages = self.compression.expand(source_stages)
+        elif codec_of(input_file) is not None:
+            source_stages = [self.compression.decompress_args(input_file)]
+            input_file = None
+        return PartitionedPipeline(
+            join_stages(shard_stages), n, key, merge_key,
+            source_args=join_stages(source_stages) if source_stages else None,
+            input_file=input_file, input_chunks=self._input_chunks(profile),
+            output_file=output_file, stdout=stdout, header=not header,
+            engine=self.engine, profile=profile, compression=self.compression,
+            resources=self.resources
+        )
+
+    def _input_chunks(self, profile=None):
+        """Return bytes csv chunks of a DataFrame input, or None."""
+        if not is_dataframe(self.input_data):
+            return None
+        header = 'nfn' not in stage_flags(split_stages(self._mcmd_args)[0])
+        chunks = df2chunks(self.input_data, self.chunksize, header,
+                           self.float_format)
+        return profile.timed_chunks(chunks) if profile is not None else chunks
+
+    def _prepare(self, output_file=None, stdout=False, header=False,
+                 profile=None):
+        """Return the arguments, keyword arguments of Pipeline and the
+        checkpoints to execute.
+
+        Placeholders of DataFrame and Mcmder given as options are replaced
+        by the paths of the FIFOs they are written into. With checkpoints,
+        the commands run from the latest valid one. With resources, msortf
+        is tuned and the commands get a temp directory of their own. With
+        optimize, the commands are rewritten first.
+        A compressed input is read through a decompressor, and a compressed
+        output_file is written by a compressor.
+        """
         if self._mcmd_args is None:
             raise McmderError("This mcmder does not have commands yet.")
         args = copy.copy(self._mcmd_args)
-        if output_file is not None and stdout:
-            args.append('|mtree o=' + output_file)
-        elif output_file is not None and not stdout:
+        if self.optimize and not self._checkpoints:
+            # Checkpoints count the commands before them, so keep them.
+            args = join_stages(optimize(split_stages(args),
+                                        self._input_schema())[0])
+        resumed, pending = False, None
+        if self._checkpoints:
+            args, resumed, pending = resume_plan(
+                args, self.input_data, self._inputs, self._checkpoints,
+                self.float_format)
+        if self.resources is not None:
+            args = join_stages(self.resources.tune(
+                split_stages(args), self.input_data))
+        stages = split_stages(args)
+        expanded = self.compression.expand(stages)
+        if len(expanded) > len(stages):
+            args = join_stages(expanded)
+            if pending is not None:
+                pending.shift(1)
+        compressed = codec_of(output_file) is not None
+        if output_file is not None and stdout and not compressed:
+            args.extend(['|', 'mtee', 'o=' + output_file])
+        elif output_file is not None and not compressed:
             args.append('o=' + output_file)
         if header:
             args.append('-nfno')
-        stdin = df2bytes(self.input_data) \
-            if isinstance(self.input_data, pandas.DataFrame) else None
-        completed_process = subprocess.run(
-            ' '.join(args), input=stdin,
-            stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True
-        )
-        if completed_process.returncode != 0:
-            raise McmdError(
-                completed_process.returncode, ' '.join(args),
-                output=completed_process.stdout,
-                stderr=completed_process.stderr
-            )
-        return completed_process.stdout
+        named_inputs = None
+        if self._inputs:
+            named_inputs = NamedInputs(self._inputs, self.chunksize,
+                                       self.float_format)
+            args = named_inputs.resolve(args)
+        kwargs = dict(
+            input_chunks=None if resumed else self._input_chunks(profile),
+            named_inputs=named_inputs,
+            temp_space=self.resources.temp_space()
+            if self.resources is not None else None)
+        if compressed:
+            # stdout of the last command goes into the compressor.
+            kwargs['output'] = self.compression.writer(output_file)
+            kwargs['stdout'] = subprocess.PIPE if stdout \
+                else kwargs['output']
+        return args, kwargs, pending
+
+    def _read_stdout(self, reader, output_file=None):
+        """Execute M-Command and return reader(stdout) of it.
+
+        When profiling, stdout is read before the reader runs, so that the
+        time to parse it is measured apart from M-Command.
+        """
+        report = self._new_profile()
+        with self._open(output_file, True, profile=report) as pipeline:
+            try:
+                if report is None:
+                    result = reader(pipeline.stdout)
+                else:
+                    output = io.BytesIO(pipeline.stdout.read())
+                    started = time.time()
+                    result = reader(output)
+                    report.parse_time = time.time() - started
+            except Exception:
+                pipeline.abort()
+                raise
+            pipeline.finish()
+        self._finish_profile(report)
+        return result
+
+    def _iter_stdout(self, reader, output_file=None):
+        """Execute M-Command and yield items of reader(stdout) of it.
+
+        Closing the generator before the end kills M-Command.
+        """
+        report = self._new_profile()
+        with self._open(output_file, True, profile=report) as pipeline:
+            try:
+                for item in reader(pipeline.stdout):
+                    yield item
+            except Exception:
+                pipeline.abort()
+                raise
+            pipeline.finish()
+        self._finish_profile(report)
 
     def mcmd(self, mcmd_name, *flags, **options):
         """Return new Mcmder added new command.
 
         flags are added as '-flag', options are added as 'key=value'
-        into M-Command
+        into M-Command. pandas.DataFrame or Mcmder given as an option like
+        m= is streamed to the command through a FIFO.
+        Unknown or missing parameters raise McmderError here if validate.
         :param str mcmd_name: M-Command name like 'mcut'
         :rtype: Mcmder
         """
-        matched_set = set(flags) & {'params', 'help', 'helpl', 'version'}
+        matched_set = set(flags) & set(INFO_FLAGS)
         if matched_set != set():
             for flag in matched_set:
-                completed_process = subprocess.run(
-                    [mcmd_name, '-' + flag], stdout=subprocess.PIPE)
-                print(completed_process.stdout)
+                print(default_registry().text(mcmd_name, flag))
             return self
+        if self._incremental is not None:
+            raise McmderError('incremental() must be the end of the chain.')
+        flags = [flag for flag in flags if flag is not None]
+        if self.validate:
+            default_registry().validate(
+                mcmd_name, flags,
+                [key for key, value in options.items() if value is not None])
         if self._mcmd_args is None:
             if isinstance(self.input_data, str):
                 next_args = [mcmd_name, 'i=' + self.input_data]
@@ -113,13 +663,117 @@ class Mcmder(object):
             next_args = copy.copy(self._mcmd_args)
             next_args.append('|')
             next_args.append(mcmd_name)
+        if 'q' not in flags and \
+                skips_sort(mcmd_name, options, self.sorted_key):
+            flags.append('q')
         for flag in flags:
-            if flag is not None:
-                next_args.append('-' + flag)
+            next_args.append('-' + flag)
+        inputs = list(self._inputs)
         for key, value in options.items():
+            if is_dataframe(value) or isinstance(value, Mcmder):
+                inputs.append(value)
+                value = placeholder(len(inputs) - 1)
             if value is not None:
                 next_args.append(key + '=' + value)
-        return Mcmder(self.input_data, True, _mcmd_args=next_args)
+        derived = self._derive(next_args)
+        derived._inputs = inputs
+        derived.sorted_key = sorted_key_after(
+            mcmd_name, options, flags, self.sorted_key)
+        return derived
+
+    def _derive(self, mcmd_args):
+        """Return a copy of this mcmder running mcmd_args."""
+        derived = copy.copy(self)
+        derived.header = True
+        derived._mcmd_args = mcmd_args
+        derived._dataframe = None
+        return derived
+
+    def assume_sorted(self, key):
+        """Return new Mcmder whose current records are sorted by key.
+
+        Following commands with the key k= then skip sorting by -q. Mcmder
+        tracks this by itself after msortf, so this is for inputs already
+        sorted as strings in ascending order.
+        :param str or list key: fields the records are sorted by
+        :rtype: Mcmder
+        """
+        derived = self._derive(self._mcmd_args)
+        derived.header = self.header
+        derived.sorted_key = to_cstr(key).split(',')
+        return derived
+
+    def checkpoint(self, path=None):
+        """Return new Mcmder keeping the records at this point on disk.
+
+        The file is written by mtee while the chain runs, and kept if the
+        commands before it succeeded, even when a later one fails. When the
+        chain runs again with the same commands and inputs, it starts from
+        the latest valid checkpoint instead. A checkpoint whose commands or
+        inputs changed is removed. It needs the 'argv' engine.
+        >>> m = Mcmder('big.csv').mjoin(k='id', m='ref.csv', f='x').checkpoint()
+        >>> m.msum(f='x', k='id').save('out.csv')
+        :param str path: file to keep the records in, in
+          ~/.cache/mcmder/checkpoints by default
+        :rtype: Mcmder
+        """
+        if self._mcmd_args is None:
+            raise McmderError("This mcmder does not have commands yet.")
+        if self.engine == 'shell':
+            raise McmderError(
+                "checkpoint() needs engine='argv', since the shell reports "
+                "only the exit status of the last command.")
+        derived = self._derive(self._mcmd_args)
+        derived.header = self.header
+        derived._checkpoints = self._checkpoints + [
+            Checkpoint(len(split_stages(self._mcmd_args)), path)]
+        return derived
+
+    def incremental(self, directory=None):
+        """Return new Mcmder aggregating only records appended since last time.
+
+        The chain must read a file with header, handle each record by
+        itself, and end with msum, mcount, muniq or mstats c=min, max or sum
+        with k=. The byte offset processed and the aggregate are kept in
+        directory, and each execution aggregates the new complete lines and
+        merges them with the previous aggregate, which is kept with full
+        precision. mavg is not supported. If the file was rewritten or the
+        chain changed, all the records are aggregated again.
+        >>> Mcmder('events.csv').msum(f='amt', k='user').incremental('state/')
+        :param str directory: directory to keep the state in, in
+          ~/.cache/mcmder/incremental by default
+        :rtype: Mcmder
+        """
+        if not isinstance(self.input_data, str) or self._inputs or \
+                codec_of(self.input_data) is not None:
+            raise McmderError(
+                'incremental() needs an uncompressed file as the input.')
+        check_chain(split_stages(self._mcmd_args))
+        derived = self._derive(self._mcmd_args)
+        derived._incremental = IncrementalState(
+            directory or default_directory(self._mcmd_args))
+        return derived
+
+    def parallel(self, n, key):
+        """Return new Mcmder running the following commands on n shards.
+
+        Records are partitioned by a hash of key, each shard runs the
+        following commands at once, and the results are merged in the order
+        the serial run outputs. This is done only when every following
+        command handles each record by itself or each key k= containing key
+        without rewriting key, and the last one outputs records sorted by its
+        key, like msum, mcount, mavg, muniq and mbest. Otherwise the chain
+        runs serially as usual.
+        >>> Mcmder('big.csv').parallel(8, key='user').msum(f='amt', k='user')
+        :param int n: number of shards
+        :param str or list key: fields to partition records by
+        :rtype: Mcmder
+        """
+        derived = self._derive(self._mcmd_args)
+        derived.header = self.header
+        derived._parallel = (n, to_cstr(key).split(','),
+                             len(split_stages(self._mcmd_args)))
+        return derived
 
     # Each Commands
     def maccum(self, f, s, k=None, *options, tmpPath=None, precision=None):
@@ -188,13 +842,13 @@ class Mcmder(object):
     def mduprec(self, f=None, n=None, *options, tmpPath=None):
         return self.mcmd('mduprec', *options, **clean_dic(locals()))
 
-    def mfldname(self, f=None, n=None, tmpPath=None):
+    def mfldname(self, f=None, n=None, *options, tmpPath=None):
         return self.mcmd('mfldname', *options, **clean_dic(locals()))
 
     def mfsort(self, f, *options, tmpPath=None):
         return self.mcmd('mfsort', *options, **clean_dic(locals()))
 
-    def mhashavg(self, f, hs=None, k=None, *options, tmpPath=None, precison=None):
+    def mhashavg(self, f, hs=None, k=None, *options, tmpPath=None, precision=None):
         return self.mcmd('mhashavg', *options, **clean_dic(locals()))
 
     def mhashsum(self, f, hs=None, k=None, *options, tmpPath=None, precision=None):
@@ -279,7 +933,7 @@ class Mcmder(object):
         return self.mcmd('mseldsp', *options, **clean_dic(locals()))
 
     def mselnum(self, f, c, k=None, u=None, *options, bufcount=None, tmpPath=None):
-        return self.mcmd('mcut', *options, **clean_dic(locals()))
+        return self.mcmd('mselnum', *options, **clean_dic(locals()))
 
     def mselrand(self, c=None, p=None, k=None, S=None, *options, tmpPath=None):
         return self.mcmd('mselrand', *options, **clean_dic(locals()))
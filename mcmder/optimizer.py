@@ -0,0 +1,245 @@
+"""Rewrite a chain into one doing the same work with fewer commands."""
+from .commands import (fields, fields_read, fields_added, schema_after,
+                       handles_each_record)
+from .utils import stage_options, stage_flags
+
+# Commands dropping records without changing them.
+FILTERS = frozenset(['msel', 'mselnum', 'mselstr'])
+
+# Commands a filter can run before, when it does not read what they add.
+# mjoin -N outputs records of the reference file not matched, which the
+# filter would not see, so only -n and -q are allowed.
+_FILTER_COMMUTES = {'mcal': frozenset(), 'mjoin': frozenset(['n', 'q']),
+                    'msortf': frozenset()}
+
+# Commands working on whole records whose input is worth narrowing.
+_EXPENSIVE = frozenset(['mjoin', 'msortf'])
+
+# Commands which fields can be pruned through, and the flags allowed.
+_PRUNABLE = {'mjoin': frozenset(['n', 'q']), 'msel': frozenset(['r']),
+             'mselnum': frozenset(['r']), 'mselstr': frozenset(['r', 'sub']),
+             'msortf': frozenset()}
+
+
+def optimize(stages, schema=None):
+    """Return the stages rewritten, and notes of what was rewritten.
+
+    Consecutive mcut and renames by mfldname are merged into one mcut,
+    an mcut keeping the records as they are is dropped, filters run before
+    mjoin, msortf and mcal they do not depend on, and the fields not used
+    after mjoin or msortf are cut before them. A chain using fields by
+    number with -nfn or -nfno is left as it is.
+    :param list stages: arguments of each command
+    :param list schema: schema of the input, to know if cutting fields
+      narrows it
+    :rtype: tuple
+    """
+    stages = [list(stage) for stage in stages]
+    notes = []
+    if any(stage_flags(stage) & set(['nfn', 'nfno']) for stage in stages):
+        return stages, notes
+    rules = (_merge_cuts, _fold_renames, _drop_cuts, _push_filters,
+             _prune_fields)
+    changed = True
+    while changed:
+        changed = False
+        for rule in rules:
+            note = rule(stages, schema)
+            if note is not None:
+                notes.append(note)
+                changed = True
+    return stages, notes
+
+
+def _cut_fields(stage):
+    """Return [(input field, output field)] of a plain mcut, or None."""
+    if stage[0] != 'mcut' or stage_flags(stage):
+        return None
+    options = stage_options(stage)
+    if not options.get('f'):
+        return None
+    return [tuple(field.split(':', 1)) if ':' in field else (field, field)
+            for field in fields(options['f'])]
+
+
+def _cut_value(pairs):
+    return ','.join(old if old == new else '%s:%s' % (old, new)
+                    for old, new in pairs)
+
+
+def _replace_option(stage, name, value):
+    return [arg for arg in stage if not arg.startswith(name + '=')] + \
+        ['%s=%s' % (name, value)]
+
+
+def _only_options(stage, names):
+    return not stage_flags(stage) and set(stage_options(stage)) <= set(names)
+
+
+def _merge_cuts(stages, schema):
+    """mcut f=a:x,b | mcut f=x:y -> mcut f=a:y"""
+    for index in range(len(stages) - 1):
+        first = _cut_fields(stages[index])
+        second = _cut_fields(stages[index + 1])
+        if first is None or second is None or \
+                not _only_options(stages[index + 1], ['f']):
+            continue
+        outputs = dict((new, old) for old, new in first)
+        if len(outputs) != len(first) or \
+                any(old not in outputs for old, _ in second):
+            continue
+        merged = _replace_option(stages[index], 'f', _cut_value(
+            [(outputs[old], new) for old, new in second]))
+        note = 'merged %s | %s' % (' '.join(stages[index]),
+                                   ' '.join(stages[index + 1]))
+        stages[index:index + 2] = [merged]
+        return note
+    return None
+
+
+def _renames(stage):
+    """Return {old: new} of mfldname renaming fields only, or None."""
+    if stage[0] != 'mfldname' or not _only_options(stage, ['f', 'i']):
+        return None
+    renames = [field.split(':', 1) for field in
+               fields(stage_options(stage).get('f'))]
+    if not renames or any(len(rename) != 2 for rename in renames):
+        return None
+    return dict(renames)
+
+
+def _fold_renames(stages, schema):
+    """mcut f=a,b | mfldname f=a:x -> mcut f=a:x,b, and the reverse."""
+    for index in range(len(stages) - 1):
+        first, second = stages[index], stages[index + 1]
+        cut = _cut_fields(first)
+        renames = _renames(second)
+        if cut is not None and renames is not None and \
+                'i' not in stage_options(second) and \
+                set(renames) <= set(new for _, new in cut):
+            folded = _replace_option(first, 'f', _cut_value(
+                [(old, renames.get(new, new)) for old, new in cut]))
+        else:
+            renames = _renames(first)
+            cut = _cut_fields(second)
+            if renames is None or cut is None or \
+                    not _only_options(second, ['f']):
+                continue
+            olds = dict((new, old) for old, new in renames.items())
+            if any(field in renames and field not in olds
+                   for field, _ in cut):
+                # The cut refers to a field the rename took away.
+                continue
+            folded = ['mcut'] + \
+                [arg for arg in first[1:] if arg.startswith('i=')] + \
+                ['f=' + _cut_value([(olds.get(old, old), new)
+                                    for old, new in cut])]
+        note = 'folded %s | %s' % (' '.join(first), ' '.join(second))
+        stages[index:index + 2] = [folded]
+        return note
+    return None
+
+
+def _drop_cuts(stages, schema):
+    """msortf f=a | mcut f=a,b -> msortf f=a, if the records are a,b"""
+    for index in range(1, len(stages)):
+        cut = _cut_fields(stages[index])
+        if cut is None or not _only_options(stages[index], ['f']):
+            continue
+        before = _schema_before(stages, index, schema)
+        if before is None or \
+                [field for field, _ in before] != [new for _, new in cut] or \
+                any(old != new for old, new in cut):
+            continue
+        note = 'dropped %s' % ' '.join(stages[index])
+        del stages[index]
+        return note
+    return None
+
+
+def _move_input(stages, source, target):
+    """Move i= of stages[source] into stages[target]."""
+    inputs = [arg for arg in stages[source][1:] if arg.startswith('i=')]
+    stages[source] = [arg for arg in stages[source] if arg not in inputs]
+    stages[target] = stages[target][:1] + inputs + stages[target][1:]
+
+
+def _push_filters(stages, schema):
+    """mjoin f=x | msel c=${a}>0 -> msel c=${a}>0 | mjoin f=x"""
+    for index in range(1, len(stages)):
+        stage, previous = stages[index], stages[index - 1]
+        options = stage_options(stage)
+        previous_options = stage_options(previous)
+        allowed = _FILTER_COMMUTES.get(previous[0])
+        # A filter with k= selects whole keys, which mjoin may have cut.
+        if stage[0] not in FILTERS or 'u' in options or 'o' in options or \
+                'k' in options:
+            continue
+        if allowed is None or not stage_flags(previous) <= allowed or \
+                'o' in previous_options:
+            continue
+        if previous[0] == 'mcal' and \
+                not handles_each_record(previous[0], previous_options):
+            # An expression of other records would see fewer of them.
+            continue
+        read = fields_read(stage[0], options, stage_flags(stage))
+        added = fields_added(previous[0], previous_options,
+                             stage_flags(previous))
+        if not read or set(read) & set(added):
+            continue
+        note = 'moved %s before %s' % (' '.join(stage), ' '.join(previous))
+        stages[index - 1:index + 1] = [stage, previous]
+        if index == 1:
+            _move_input(stages, 1, 0)
+        return note
+    return None
+
+
+def _prune_fields(stages, schema):
+    """msortf f=a | mcut f=a,b -> mcut f=a,b | msortf f=a | mcut f=a,b"""
+    for end in range(len(stages) - 1, 0, -1):
+        cut = _cut_fields(stages[end])
+        if cut is None:
+            continue
+        required = [old for old, _ in cut]
+        start = end
+        while start > 0:
+            stage = stages[start - 1]
+            allowed = _PRUNABLE.get(stage[0])
+            options, flags = stage_options(stage), stage_flags(stage)
+            read = fields_read(stage[0], options, flags)
+            if allowed is None or not flags <= allowed or read is None or \
+                    'o' in options or 'u' in options:
+                break
+            added = fields_added(stage[0], options, flags)
+            required = [field for field in required if field not in added]
+            required += [field for field in read if field not in required]
+            start -= 1
+        if not any(stage[0] in _EXPENSIVE for stage in stages[start:end]):
+            continue
+        before = _schema_before(stages, start, schema)
+        if before is None:
+            # Without the fields, cutting may add a command for nothing.
+            continue
+        width = set(field for field, _ in before)
+        if width <= set(required) or not set(required) <= width:
+            continue
+        stages.insert(start, ['mcut', 'f=' + ','.join(required)])
+        if start == 0:
+            _move_input(stages, 1, 0)
+        return 'cut %s before %s' % (','.join(required),
+                                     ' '.join(stages[start + 1]))
+    return None
+
+
+def _schema_before(stages, index, schema):
+    for stage in stages[:index]:
+        schema = schema_after(stage[0], stage_options(stage),
+                              stage_flags(stage), schema)
+    return schema
+
+
+def format_plan(stages):
+    """Return the commands one per line, as they are piped."""
+    return '\n'.join(('  ' if index == 0 else '| ') + ' '.join(stage)
+                     for index, stage in enumerate(stages))
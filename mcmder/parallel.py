@@ -0,0 +1,250 @@
+"""Run the tail of a chain on key-partitioned shards of its input."""
+import io
+import os
+import csv
+import heapq
+import shutil
+import signal
+import zlib
+import tempfile
+import threading
+import subprocess
+
+from .compression import open_output
+from .errors import McmderError, McmdError
+from .executor import PipelineBase, Pipeline, close_quietly
+
+
+class PartitionedPipeline(PipelineBase):
+    """Run a statement on shards of the input and merge the results.
+
+    Records are sent to a shard by a hash of their key fields, so all the
+    records of a key are in one shard. Each shard outputs records sorted by
+    merge_key, and the outputs are merged by it, so the result is the same
+    as running the statement once on all the records.
+    """
+
+    def __init__(self, args, n, key, merge_key, source_args=None,
+                 input_file=None, input_chunks=None, output_file=None,
+                 stdout=True, header=True, engine='argv', profile=None,
+                 compression=None, resources=None):
+        """Start the source and the shards.
+
+        :param list args: arguments of M-Command run on each shard
+        :param int n: number of shards
+        :param list key: fields to partition the records by
+        :param list merge_key: fields the shard outputs are sorted by
+        :param list source_args: arguments of M-Command whose output is
+          partitioned
+        :param str input_file: file partitioned if source_args is None
+        :param iterable input_chunks: bytes csv given to source_args,
+          or partitioned if source_args and input_file are None
+        :param str output_file: file path to write the merged result
+        :param bool stdout: write the merged result also into stdout
+        :param bool header: write the header of the merged result
+        :param str engine: 'argv' or 'shell', see executor.Pipeline
+        :param profile.Profile profile: report to add the processes to
+        :param compression.Compression compression: compresses output_file
+          if its suffix tells so
+        :param resources.ResourcePolicy resources: gives the source and each
+          shard a temp directory, which share the quota
+        """
+        self.statement = ' '.join(args)
+        self.returncode = None
+        self._failed = None
+        self._error = None
+        self._killed = False
+        self._tmpdir = tempfile.mkdtemp(prefix='mcmder-')
+        read_fd, write_fd = os.pipe()
+        self.stdout = os.fdopen(read_fd, 'rb')
+        self._output = os.fdopen(write_fd, 'wb')
+        self._source = None
+        shares = n + (source_args is not None)
+        if source_args is not None:
+            self._source = Pipeline(
+                source_args, input_chunks, engine=engine, profile=profile,
+                temp_space=_temp_space(resources, shares))
+            stream = self._source.stdout
+        elif input_file is not None:
+            stream = open(input_file, 'rb')
+        else:
+            stream = _lines(input_chunks)
+        self._paths = []
+        self._shards = []
+        for index in range(n):
+            path = os.path.join(self._tmpdir, '%d.csv' % index)
+            with open(path, 'wb') as shard_output:
+                self._shards.append(Pipeline(
+                    args, stdout=shard_output, stdin=subprocess.PIPE,
+                    engine=engine, profile=profile,
+                    temp_space=_temp_space(resources, shares)))
+            self._paths.append(path)
+        self._thread = threading.Thread(target=self._run, args=(
+            stream, key, merge_key, output_file,
+            stdout or output_file is None, header, compression))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self, stream, key, merge_key, output_file, stdout, header,
+             compression):
+        try:
+            try:
+                self._partition(stream, key)
+            finally:
+                stream.close()
+                for shard in self._shards:
+                    close_quietly(shard.stdin)
+            for pipeline in self._pipelines():
+                if pipeline.wait() != 0 and self._failed is None:
+                    self._failed = pipeline
+            if self._killed:
+                self.returncode = -signal.SIGKILL
+            elif self._failed is not None:
+                self.returncode = self._failed.returncode
+            else:
+                files = [open_output(output_file, compression)] \
+                    if output_file is not None else []
+                try:
+                    _merge(self._paths, merge_key,
+                           ([self._output] if stdout else []) + files, header)
+                finally:
+                    for output in files:
+                        output.close()
+                self.returncode = 0
+        except BrokenPipeError:
+            self.returncode = -signal.SIGPIPE
+        except Exception as error:
+            self._error = error
+            self.returncode = 1
+        finally:
+            close_quietly(self._output)
+
+    def _partition(self, stream, key):
+        records = _records(stream)
+        header = next(records, None)
+        if header is None:
+            return
+        fields = _split(header)
+        index = []
+        for field in key:
+            if field.encode() not in fields:
+                raise McmderError(
+                    "Key field '%s' is not in the input." % field)
+            index.append(fields.index(field.encode()))
+        stdins = [shard.stdin for shard in self._shards]
+        try:
+            for stdin in stdins:
+                stdin.write(header)
+            for record in records:
+                fields = _split(record)
+                shard_key = b'\0'.join(fields[i] for i in index)
+                stdins[zlib.crc32(shard_key) % len(stdins)].write(record)
+        except BrokenPipeError:
+            # A shard stopped reading; its exit status tells why.
+            pass
+
+    def _pipelines(self):
+        return ([self._source] if self._source is not None else []) + \
+            self._shards
+
+    def wait(self):
+        """Wait for the source, the shards and the merge to finish.
+
+        :rtype: int
+        """
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+        return self.returncode
+
+    def kill(self):
+        """Kill the source and the shards if they are still running."""
+        self._killed = True
+        self.stdout.close()
+        for pipeline in self._pipelines():
+            pipeline.kill()
+        self.wait()
+
+    def terminate(self):
+        """Kill the source and the shards without waiting for them."""
+        self._killed = True
+        for pipeline in self._pipelines():
+            pipeline.terminate()
+
+    def check(self, output=None):
+        """Raise McmdError if the source or a shard failed."""
+        if self.returncode == 0:
+            return
+        if self._failed is not None:
+            raise McmdError(
+                self._failed.returncode, self._failed.statement,
+                output=output, stderr=self._failed.stderr
+            )
+        raise McmdError(self.returncode, self.statement, output=output)
+
+    def close(self):
+        self.stdout.close()
+        for pipeline in self._pipelines():
+            pipeline.close()
+        shutil.rmtree(self._tmpdir, ignore_errors=True)
+
+
+def _temp_space(resources, shares):
+    return resources.temp_space(shares) if resources is not None else None
+
+
+def _lines(input_chunks):
+    for chunk in input_chunks:
+        for line in io.BytesIO(chunk):
+            yield line
+
+
+def _records(stream):
+    """Yield each csv record of the stream as bytes ending with newline.
+
+    A record whose quoted field has newlines spans several lines.
+    """
+    pending = b''
+    for line in stream:
+        record = pending + line
+        if record.count(b'"') % 2:
+            pending = record
+            continue
+        pending = b''
+        yield record if record.endswith(b'\n') else record + b'\n'
+    if pending:
+        yield pending + b'\n'
+
+
+def _split(record):
+    line = record.rstrip(b'\r\n')
+    if b'"' not in line:
+        return line.split(b',')
+    return [field.encode()
+            for field in next(csv.reader([line.decode('utf-8')]))]
+
+
+def _merge(paths, merge_key, outputs, header):
+    """Merge csv files sorted by merge_key into outputs."""
+    files = [open(path, 'rb') for path in paths]
+    try:
+        headers = [csv_file.readline() for csv_file in files]
+        first = next((line for line in headers if line), None)
+        if first is None:
+            return
+        if header:
+            for output in outputs:
+                output.write(first)
+        fields = _split(first)
+        index = [fields.index(field.encode()) for field in merge_key]
+        streams = [
+            ((tuple(_split(record)[i] for i in index), record)
+             for record in _records(csv_file))
+            for csv_file in files
+        ]
+        for _, record in heapq.merge(*streams, key=lambda item: item[0]):
+            for output in outputs:
+                output.write(record)
+    finally:
+        for csv_file in files:
+            csv_file.close()
@@ -0,0 +1,186 @@
+"""Execute several chains sharing their first commands in a single pass."""
+import os
+import threading
+import subprocess
+
+from .compression import codec_of, open_output
+from .executor import Pipeline, close_quietly
+from .optimizer import optimize
+from .utils import split_stages, join_stages
+
+# Bytes the fan-out reads from the shared commands at once.
+_FAN_OUT_SIZE = 1 << 16
+
+
+def shared_prefix(mcmders):
+    """Return the commands all mcmders start with and the rest of each.
+
+    Only mcmders of the same input share commands. The commands of an
+    mcmder with optimize are rewritten first.
+    :param list mcmders: list of Mcmder
+    :return: (list of stages of the prefix, list of stages of each tail)
+    :rtype: tuple
+    """
+    stages = [_stages(mcmder) for mcmder in mcmders]
+    first = mcmders[0].input_data
+    same_input = all(
+        mcmder.input_data is first or
+        isinstance(first, str) and mcmder.input_data == first
+        for mcmder in mcmders)
+    length = 0
+    if same_input:
+        while all(len(stage) > length for stage in stages) and \
+                all(stage[length] == stages[0][length] for stage in stages):
+            length += 1
+    return stages[0][:length], [stage[length:] for stage in stages]
+
+
+def materialize_all(mcmders, outputs=None):
+    """Execute mcmders, running their shared commands only once.
+
+    The output of the shared commands is fanned out to the rest of each
+    chain while it is produced, so the input is read in a single pass.
+    Mcmders sharing no commands, given DataFrame or Mcmder as an option,
+    having checkpoints, a cache or profile, or being incremental are
+    executed one by one.
+    resources of the first mcmder tune the sorts of all the chains, and
+    give each pipeline a temp directory, which share the quota.
+    :param list mcmders: list of Mcmder
+    :param list outputs: file path to write for each mcmder, or None to
+      read each result as pandas.DataFrame
+    :return: list of pandas.DataFrame, or outputs
+    :rtype: list
+    """
+    mcmders = list(mcmders)
+    if outputs is not None and len(outputs) != len(mcmders):
+        raise ValueError('outputs must have a path for each mcmder.')
+    prefix, tails = shared_prefix(mcmders)
+    if not prefix or any(mcmder._inputs or mcmder._checkpoints or
+                         mcmder._incremental or mcmder.cache is not None or
+                         mcmder.profile for mcmder in mcmders):
+        if outputs is None:
+            return [mcmder.dataframe for mcmder in mcmders]
+        for mcmder, output in zip(mcmders, outputs):
+            mcmder.save(output)
+        return outputs
+    first = mcmders[0]
+    resources = first.resources
+    shares = 1 + sum(1 for tail in tails if tail)
+    if resources is not None:
+        # The shared commands and the tails sort at once.
+        tuned = resources.tune(prefix + [stage for tail in tails
+                                         for stage in tail],
+                               first.input_data)
+        prefix, rest = tuned[:len(prefix)], tuned[len(prefix):]
+        for index, tail in enumerate(tails):
+            tails[index], rest = rest[:len(tail)], rest[len(tail):]
+    readers = []
+    sinks = []
+    tail_pipelines = []
+    try:
+        with Pipeline(join_stages(first.compression.expand(prefix)),
+                      first._input_chunks(), engine=first.engine,
+                      temp_space=_temp_space(resources, shares)) as source:
+            try:
+                for index, tail in enumerate(tails):
+                    output = outputs[index] if outputs is not None else None
+                    sinks.append(None)
+                    compression = mcmders[index].compression
+                    if tail:
+                        args = join_stages(tail)
+                        writer = None
+                        if codec_of(output) is not None:
+                            writer = compression.writer(output)
+                        elif output is not None:
+                            args.append('o=' + output)
+                        pipeline = Pipeline(
+                            args, stdin=subprocess.PIPE, engine=first.engine,
+                            stdout=subprocess.PIPE if output is None
+                            else writer or subprocess.DEVNULL, output=writer,
+                            temp_space=_temp_space(resources, shares))
+                        tail_pipelines.append(pipeline)
+                        sinks[-1] = pipeline.stdin
+                        stream = pipeline.stdout
+                    elif output is not None:
+                        sinks[-1] = open_output(output, compression)
+                        stream = None
+                    else:
+                        read_fd, write_fd = os.pipe()
+                        sinks[-1] = os.fdopen(write_fd, 'wb')
+                        stream = os.fdopen(read_fd, 'rb')
+                    readers.append(_Reader(stream, mcmders[index]))
+                _fan_out(source.stdout, sinks)
+            finally:
+                for sink in sinks:
+                    if sink is not None:
+                        close_quietly(sink)
+                for pipeline in tail_pipelines:
+                    pipeline.wait()
+                for reader in readers:
+                    reader.join()
+            source.finish()
+        for pipeline in tail_pipelines:
+            pipeline.check()
+    finally:
+        for pipeline in tail_pipelines:
+            pipeline.close()
+    for reader in readers:
+        if reader.error is not None:
+            raise reader.error
+    if outputs is not None:
+        return outputs
+    for mcmder, reader in zip(mcmders, readers):
+        mcmder._dataframe = reader.result
+    return [reader.result for reader in readers]
+
+
+def _stages(mcmder):
+    """Return the stages of mcmder, rewritten if it optimizes."""
+    stages = split_stages(mcmder._mcmd_args)
+    if mcmder.optimize:
+        stages = optimize(stages, mcmder._input_schema())[0]
+    return stages
+
+
+def _temp_space(resources, shares):
+    return resources.temp_space(shares) if resources is not None else None
+
+
+def _fan_out(source, sinks):
+    """Copy source into every sink, dropping sinks whose reader is gone."""
+    sinks = list(sinks)
+    for chunk in iter(lambda: source.read1(_FAN_OUT_SIZE), b''):
+        for sink in list(sinks):
+            try:
+                sink.write(chunk)
+            except BrokenPipeError:
+                sinks.remove(sink)
+
+
+class _Reader(threading.Thread):
+    """Parse a stream into pandas.DataFrame in the background."""
+
+    def __init__(self, stream, mcmder):
+        super(_Reader, self).__init__()
+        self.daemon = True
+        self.stream = stream
+        self.mcmder = mcmder
+        self.result = None
+        self.error = None
+        if stream is not None:
+            # Readers importing pandas for the first time at once see it
+            # half initialized.
+            import pandas
+            self.start()
+
+    def run(self):
+        try:
+            self.result = self.mcmder._parse(self.stream)
+        except Exception as error:
+            self.error = error
+        finally:
+            self.stream.close()
+
+    def join(self, timeout=None):
+        if self.stream is not None:
+            super(_Reader, self).join(timeout)
@@ -0,0 +1,119 @@
+"""Profile reports of executed M-Command."""
+import os
+import sys
+import json
+import time
+
+
+class StageProfile(object):
+    """Measurements of one process of a statement.
+
+    Times are in seconds and max_rss is in bytes. output_bytes and
+    output_rows count what the process wrote to the next one or to
+    stdout, including the header line, and stay None when not counted.
+    """
+
+    def __init__(self, command, pid):
+        self.command = command
+        self.pid = pid
+        self.returncode = None
+        self.wall_time = None
+        self.user_time = None
+        self.system_time = None
+        self.max_rss = None
+        self.output_bytes = None
+        self.output_rows = None
+
+    def record(self, status, rusage, started):
+        """Record the status and rusage returned by os.wait4."""
+        self.wall_time = time.time() - started
+        self.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) \
+            else os.WEXITSTATUS(status)
+        self.user_time = rusage.ru_utime
+        self.system_time = rusage.ru_stime
+        # Linux reports kilobytes, macOS reports bytes.
+        self.max_rss = rusage.ru_maxrss * (
+            1 if sys.platform == 'darwin' else 1024)
+
+    def count(self, chunk):
+        """Count a chunk the process wrote."""
+        self.output_bytes = (self.output_bytes or 0) + len(chunk)
+        self.output_rows = (self.output_rows or 0) + chunk.count(b'\n')
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+    def __repr__(self):
+        return '<StageProfile %r wall_time=%s>' % (
+            self.command, self.wall_time)
+
+
+class Profile(object):
+    """Report of one execution of Mcmder.
+
+    Attributes:
+      statement: executed statement
+      stages: list of StageProfile of each process
+      wall_time: seconds from start to the end of reading the result
+      encode_time: seconds spent converting the DataFrame input to csv
+      input_bytes: bytes of csv written from the DataFrame input
+      parse_time: seconds spent parsing the result, or None
+      cached: the result was read from ResultCache
+    """
+
+    def __init__(self, statement=None, hook=None):
+        """Start measuring the wall time.
+
+        :param str statement: executed statement
+        :param callable hook: called with the report when it is finished
+        """
+        self.statement = statement
+        self.hook = hook
+        self.stages = []
+        self.wall_time = None
+        self.encode_time = 0.0
+        self.input_bytes = 0
+        self.parse_time = None
+        self.cached = False
+        self._started = time.time()
+
+    def finish(self):
+        """Stop measuring the wall time and call the hook."""
+        self.wall_time = time.time() - self._started
+        if self.hook is not None:
+            self.hook(self)
+
+    def timed_chunks(self, chunks):
+        """Yield chunks, adding the time to make them to encode_time."""
+        chunks = iter(chunks)
+        while True:
+            started = time.time()
+            chunk = next(chunks, None)
+            self.encode_time += time.time() - started
+            if chunk is None:
+                return
+            self.input_bytes += len(chunk)
+            yield chunk
+
+    def to_dict(self):
+        return {
+            'statement': self.statement,
+            'wall_time': self.wall_time,
+            'encode_time': self.encode_time,
+            'input_bytes': self.input_bytes,
+            'parse_time': self.parse_time,
+            'cached': self.cached,
+            'stages': [stage.to_dict() for stage in self.stages],
+        }
+
+    def to_json(self, **kwargs):
+        """Return the report as JSON.
+
+        :param kwargs: passed to json.dumps
+        :rtype: str
+        """
+        return json.dumps(self.to_dict(), **kwargs)
+
+    def __repr__(self):
+        return '<Profile %r stages=%d wall_time=%s>' % (
+            self.statement, len(self.stages), self.wall_time)
@@ -0,0 +1,90 @@
+"""Read the csv output of M-Command as pandas, Arrow or NumPy."""
+import io
+import csv
+
+from .errors import McmderError
+
+OUTPUTS = ('pandas', 'arrow', 'numpy')
+
+_PANDAS_TYPES = {'str': str, 'int': 'int64', 'float': 'float64'}
+
+
+def schema_from_file(path, compression=None):
+    """Return the schema of a csv file from its header, with unknown types.
+
+    None is returned if the header is not utf-8, like Shift_JIS.
+    :param str path: csv file with header
+    :param compression.Compression compression: reads a compressed file
+    :rtype: list of tuple
+    """
+    try:
+        if compression is None:
+            with io.open(path, encoding='utf-8', newline='') as csv_file:
+                names = next(csv.reader(csv_file), None)
+        else:
+            with compression.open_input(path) as stream:
+                csv_file = io.TextIOWrapper(stream, encoding='utf-8',
+                                            newline='')
+                names = next(csv.reader(csv_file), None)
+                csv_file.detach()
+    except UnicodeDecodeError:
+        return None
+    return [(name, None) for name in names] if names else None
+
+
+def dtypes_of(schema, dtype=None):
+    """Return dtypes to read the fields of schema, updated by dtype.
+
+    :param list schema: list of (field, type), or None
+    :param dict dtype: dtypes given for some fields
+    :rtype: dict
+    """
+    dtypes = dict((field, _PANDAS_TYPES[kind]) for field, kind in schema or []
+                  if kind is not None)
+    dtypes.update(dtype or {})
+    return dtypes
+
+
+def read_result(stream, schema=None, dtype=None, parser=None,
+                output='pandas'):
+    """Parse the csv output of M-Command.
+
+    :param stream: binary file object of the csv
+    :param list schema: fields and types known from the chain, or None
+    :param dict dtype: dtypes given for some fields, which override schema
+    :param str parser: engine of pandas.read_csv like 'c' or 'pyarrow'
+    :param str output: 'pandas' for pandas.DataFrame, 'arrow' for
+      pyarrow.Table or 'numpy' for numpy.recarray
+    """
+    if output not in OUTPUTS:
+        raise ValueError('output must be one of %s.' % ', '.join(OUTPUTS))
+    dtypes = dtypes_of(schema, dtype)
+    if output == 'arrow':
+        return _read_arrow(stream, dtypes)
+    import pandas
+    dataframe = pandas.read_csv(stream, dtype=dtypes or None,
+                                engine=parser)
+    if output == 'numpy':
+        return dataframe.to_records(index=False)
+    return dataframe
+
+
+def _read_arrow(stream, dtypes):
+    import numpy
+    try:
+        import pyarrow
+        import pyarrow.csv
+    except ImportError:
+        raise McmderError("output='arrow' needs pyarrow installed.")
+    column_types = {}
+    for field, dtype in dtypes.items():
+        if isinstance(dtype, pyarrow.DataType):
+            column_types[field] = dtype
+        elif dtype is str or dtype == 'str':
+            column_types[field] = pyarrow.string()
+        else:
+            column_types[field] = pyarrow.from_numpy_dtype(
+                numpy.dtype(dtype))
+    return pyarrow.csv.read_csv(
+        stream, convert_options=pyarrow.csv.ConvertOptions(
+            column_types=column_types))
@@ -0,0 +1,193 @@
+"""Parameters of installed M-Command, cached on disk."""
+import os
+import json
+import shutil
+import inspect
+import tempfile
+import subprocess
+
+from .errors import McmderError
+
+# Flags of mcmd() printing what the command tells about itself.
+INFO_FLAGS = ('params', 'help', 'helpl', 'version')
+
+# Parameters Mcmder gives to a command by itself.
+_IMPLICIT = frozenset(['i', 'o', 'nfn', 'nfno', 'q'])
+
+_default = None
+
+
+def default_registry():
+    """Return the registry shared by Mcmder, made on first use.
+
+    :rtype: ParamRegistry
+    """
+    global _default
+    if _default is None:
+        _default = ParamRegistry()
+    return _default
+
+
+def parse_params(text):
+    """Parse the output of '-params' of a command.
+
+    The first line lists the parameters like 'f=,i=,o=,-r', and the
+    second one, if any, the parameters which must be given.
+    :param str text: output of the command
+    :return: (options, flags, required) as lists of names without '=' or
+      '-', or None if text does not list parameters
+    :rtype: tuple
+    """
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    if not lines:
+        return None
+    options, flags = [], []
+    for param in lines[0].split(','):
+        param = param.strip()
+        if param.startswith('-') and len(param) > 1:
+            flags.append(param[1:])
+        elif param.endswith('=') and len(param) > 1:
+            options.append(param[:-1])
+        elif param:
+            return None
+    required = []
+    if len(lines) > 1:
+        required = [param.strip().rstrip('=').lstrip('-')
+                    for param in lines[1].split(',') if param.strip()]
+    return options, flags, required
+
+
+class ParamRegistry(object):
+    """Parameters and help texts of each installed command.
+
+    A command is asked with '-params' only the first time, and what it
+    told is kept in a json file until the executable is replaced. Commands
+    not installed or not telling their parameters are not validated.
+    """
+
+    def __init__(self, path=None):
+        """Load the cached parameters.
+
+        :param str path: ~/.cache/mcmder/params.json by default
+        """
+        if path is None:
+            path = os.path.join(
+                os.path.expanduser('~'), '.cache', 'mcmder', 'params.json')
+        self.path = path
+        try:
+            with open(path) as cache_file:
+                self._entries = json.load(cache_file)
+        except (OSError, ValueError):
+            self._entries = {}
+
+    def _entry(self, name):
+        """Return the cached entry of the installed command, or None."""
+        executable = shutil.which(name)
+        if executable is None:
+            return None
+        stamp = '%s:%d' % (executable, os.stat(executable).st_mtime_ns)
+        entry = self._entries.get(name)
+        if entry is None or entry['stamp'] != stamp:
+            entry = {'stamp': stamp, 'texts': {}}
+            self._entries[name] = entry
+        return entry
+
+    def text(self, name, flag):
+        """Return what the command prints for a flag like 'help'.
+
+        :param str name: M-Command name
+        :param str flag: one of INFO_FLAGS
+        :rtype: str
+        """
+        entry = self._entry(name)
+        if entry is None:
+            raise McmderError("Command '%s' is not installed." % name)
+        if flag not in entry['texts']:
+            completed_process = subprocess.run(
+                [name, '-' + flag], stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT)
+            entry['texts'][flag] = completed_process.stdout.decode(
+                'utf-8', 'replace')
+            self.save()
+        return entry['texts'][flag]
+
+    def params(self, name):
+        """Return (options, flags, required) of the command, or None.
+
+        :param str name: M-Command name
+        :rtype: tuple
+        """
+        entry = self._entry(name)
+        if entry is None:
+            return None
+        return parse_params(self.text(name, 'params'))
+
+    def validate(self, name, flags, options):
+        """Raise McmderError if the command does not take the parameters.
+
+        :param str name: M-Command name
+        :param list flags: flags without '-'
+        :param list options: option names without '='
+        """
+        params = self.params(name)
+        if params is None:
+            return
+        known_options, known_flags, required = params
+        unknown = ['%s=' % option for option in options
+                   if option not in known_options and
+                   option not in _IMPLICIT] + \
+                  ['-%s' % flag for flag in flags
+                   if flag not in known_flags and flag not in _IMPLICIT]
+        if unknown:
+            raise McmderError("%s does not take %s. It takes %s." % (
+                name, ', '.join(unknown), ','.join(
+                    [option + '=' for option in known_options] +
+                    ['-' + flag for flag in known_flags])))
+        missing = [param for param in required
+                   if param not in options and param not in flags and
+                   param not in _IMPLICIT]
+        if missing:
+            raise McmderError("%s needs %s." % (name, ', '.join(
+                param + '=' for param in missing)))
+
+    def wrapper_mismatches(self, mcmder_class):
+        """Compare the wrapper methods with the installed commands.
+
+        :param type mcmder_class: Mcmder
+        :return: {method name: parameters the command does not take}
+        :rtype: dict
+        """
+        mismatches = {}
+        for name, method in inspect.getmembers(mcmder_class):
+            if not name.startswith('m') or name == 'mcmd' or \
+                    not callable(method):
+                continue
+            params = self.params(name)
+            if params is None:
+                continue
+            known = set(params[0]) | set(params[1]) | _IMPLICIT
+            unknown = [
+                param for param in inspect.signature(method).parameters
+                if param not in ('self', 'options') and
+                param.rstrip('_') not in known
+            ]
+            if unknown:
+                mismatches[name] = unknown
+        return mismatches
+
+    def save(self):
+        """Write the cached parameters, keeping them in memory on failure."""
+        directory = os.path.dirname(self.path)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            file_descriptor, path = tempfile.mkstemp(
+                suffix='.tmp', dir=directory)
+            with os.fdopen(file_descriptor, 'w') as cache_file:
+                json.dump(self._entries, cache_file)
+            os.replace(path, self.path)
+        except OSError:
+            pass
+
+    def __repr__(self):
+        return '<ParamRegistry %r commands=%d>' % (
+            self.path, len(self._entries))
@@ -0,0 +1,215 @@
+"""Choose sort parameters and give each pipeline its own temp directory."""
+import os
+import shutil
+import tempfile
+import threading
+
+from .compression import codec_of
+from .errors import McmderError
+from .utils import stage_options, is_dataframe
+
+# Bytes of the input read to estimate the length of a line.
+_SAMPLE_SIZE = 1 << 16
+
+# Bytes msortf is assumed to use in memory for each byte of a line.
+_SORT_OVERHEAD = 4
+
+# Seconds between checks of the size of a temp directory.
+_POLL_INTERVAL = 0.2
+
+
+def available_memory():
+    """Return bytes of memory available without swapping, or None."""
+    try:
+        with open('/proc/meminfo') as meminfo:
+            for line in meminfo:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def input_size(input_data):
+    """Return (bytes, bytes of a line) of an input, or (None, None).
+
+    :param str or pandas.DataFrame input_data: input of Mcmder
+    :rtype: tuple
+    """
+    if codec_of(input_data) is not None:
+        # The size of the decompressed records is not known.
+        return None, None
+    if isinstance(input_data, str):
+        size = os.path.getsize(input_data)
+        with open(input_data, 'rb') as csv_file:
+            sample = csv_file.read(_SAMPLE_SIZE)
+        lines = sample.count(b'\n')
+        return size, len(sample) // lines if lines else max(size, 1)
+    if is_dataframe(input_data) and len(input_data):
+        size = int(input_data.memory_usage(index=False).sum())
+        return size, max(size // len(input_data), 1)
+    return None, None
+
+
+class ResourcePolicy(object):
+    """How much CPU, memory and temp space the commands of a chain use.
+
+    msortf in the chain is given threadCnt=, maxlines= and pways= it does
+    not have, from the CPU count, the available memory and the input size.
+    Each execution gets its own temp directory under tmp_dir, given to
+    M-Command by KG_TmpPath, which is removed when the execution ends in
+    any way. With a quota, the execution is killed when its temp directory
+    grows larger.
+    """
+
+    def __init__(self, tmp_dir=None, quota=None, memory=None, cpus=None,
+                 memory_fraction=0.5, max_threads=8):
+        """
+        :param str tmp_dir: directory of the temp directories, the default
+          temp directory by default
+        :param int quota: bytes each temp directory may use
+        :param int memory: bytes of memory for the chain, memory_fraction
+          of the available memory by default
+        :param int cpus: number of threads a sort may use, the CPU count
+          by default
+        :param float memory_fraction: fraction of the available memory
+          used when memory is None
+        :param int max_threads: upper bound of threadCnt=
+        """
+        self.tmp_dir = tmp_dir
+        self.quota = quota
+        self.memory = memory
+        self.cpus = cpus
+        self.memory_fraction = memory_fraction
+        self.max_threads = max_threads
+
+    def sort_options(self, input_data, sorts=1):
+        """Return options of msortf for the input.
+
+        :param str or pandas.DataFrame input_data: input of Mcmder
+        :param int sorts: number of msortf sharing the memory
+        :rtype: dict
+        """
+        cpus = self.cpus or os.cpu_count() or 1
+        options = {'threadCnt': str(max(1, min(cpus, self.max_threads)))}
+        memory = self.memory
+        if memory is None:
+            available = available_memory()
+            memory = int(available * self.memory_fraction) \
+                if available else None
+        size, line = input_size(input_data)
+        if memory is None or size is None:
+            return options
+        maxlines = memory // sorts // (line * _SORT_OVERHEAD)
+        maxlines = max(100000, min(maxlines, 50000000))
+        runs = -(-size // line // maxlines)
+        options['maxlines'] = str(maxlines)
+        options['pways'] = str(max(2, min(runs, 64)))
+        return options
+
+    def tune(self, stages, input_data):
+        """Return stages with the options chosen for msortf added.
+
+        Options given by hand are kept.
+        :param list stages: arguments of each command
+        :param str or pandas.DataFrame input_data: input of Mcmder
+        :rtype: list
+        """
+        sorts = sum(1 for stage in stages if stage[0] == 'msortf')
+        if not sorts:
+            return stages
+        options = self.sort_options(input_data, sorts)
+        tuned = []
+        for stage in stages:
+            if stage[0] == 'msortf':
+                given = stage_options(stage)
+                stage = stage + ['%s=%s' % (name, value)
+                                 for name, value in sorted(options.items())
+                                 if name not in given]
+            tuned.append(stage)
+        return tuned
+
+    def temp_space(self, shares=1):
+        """Return a new TempSpace for an execution.
+
+        :param int shares: number of pipelines of the execution running at
+          once, like shards, which split the quota
+        :rtype: TempSpace
+        """
+        quota = self.quota // shares if self.quota is not None else None
+        return TempSpace(self.tmp_dir, quota)
+
+    def __repr__(self):
+        return '<ResourcePolicy tmp_dir=%r quota=%r>' % (
+            self.tmp_dir, self.quota)
+
+
+class TempSpace(object):
+    """A temp directory of one execution, watched for its quota."""
+
+    def __init__(self, root=None, quota=None):
+        """
+        :param str root: directory to make the temp directory in
+        :param int quota: bytes the temp directory may use
+        """
+        if root is not None:
+            os.makedirs(root, exist_ok=True)
+        self.path = tempfile.mkdtemp(prefix='mcmder-tmp-', dir=root)
+        self.quota = quota
+        self.error = None
+        self._stopped = threading.Event()
+        self._watcher = None
+
+    @property
+    def env(self):
+        """Environment of the commands using the temp directory."""
+        env = dict(os.environ)
+        env['KG_TmpPath'] = self.path
+        env['TMPDIR'] = self.path
+        return env
+
+    def usage(self):
+        """Return bytes of the files in the temp directory."""
+        total = 0
+        for directory, _, names in os.walk(self.path):
+            for name in names:
+                try:
+                    total += os.path.getsize(os.path.join(directory, name))
+                except FileNotFoundError:
+                    pass
+        return total
+
+    def start(self, kill):
+        """Watch the quota, calling kill if the temp directory exceeds it.
+
+        :param callable kill: kills the commands
+        """
+        if self.quota is None:
+            return
+        self._watcher = threading.Thread(target=self._watch, args=(kill,))
+        self._watcher.daemon = True
+        self._watcher.start()
+
+    def _watch(self, kill):
+        while not self._stopped.wait(_POLL_INTERVAL):
+            usage = self.usage()
+            if usage > self.quota:
+                self.error = McmderError(
+                    'Temp files of M-Command used %d bytes, over the quota '
+                    'of %d bytes.' % (usage, self.quota))
+                kill()
+                return
+
+    def finish(self):
+        """Stop watching the quota."""
+        self._stopped.set()
+        if self._watcher is not None:
+            self._watcher.join()
+
+    def close(self):
+        """Stop watching and remove the temp directory."""
+        self.finish()
+        shutil.rmtree(self.path, ignore_errors=True)
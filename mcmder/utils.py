@@ -1,14 +1,83 @@
-def df2bytes(dataframe):
+import re
+import sys
+
+DEFAULT_CHUNKSIZE = 10000
+
+
+def is_dataframe(obj):
+    """Return True if obj is pandas.DataFrame, without importing pandas.
+
+    Nothing can be a DataFrame before pandas is imported by someone, so
+    pandas is loaded only when it is really used.
+    """
+    pandas = sys.modules.get('pandas')
+    return pandas is not None and isinstance(obj, pandas.DataFrame)
+
+
+def df2bytes(dataframe, header=True, float_format=None):
     """Convert pandas.DataFrame to bytes csv.
 
     :param pandas.DataFrame dataframe: dataframe to convert
+    :param bool header: write the column names first
+    :param str float_format: format of floats like '%.6f'
     :return: bytes of csv
     :rtype: bytes
     """
-    return '\n'.join(
-        [','.join(dataframe), ] +
-        [','.join(map(str, row)) for row in dataframe.values]
-    ).encode()
+    return b''.join(df2chunks(dataframe, header=header,
+                              float_format=float_format))
+
+
+def df2chunks(dataframe, chunksize=DEFAULT_CHUNKSIZE, header=True,
+              float_format=None):
+    """Convert pandas.DataFrame to bytes csv, chunksize rows at a time.
+
+    Each chunk is converted column by column and the fields of a row are
+    joined once. Fields with commas, quotes or newlines are quoted, and NaN
+    and None become empty fields, which M-Command reads as null.
+    :param pandas.DataFrame dataframe: dataframe to convert
+    :param int chunksize: number of rows in each chunk
+    :param bool header: write the column names first
+    :param str float_format: format of floats like '%.6f', the shortest
+      representation that reads back the same float by default
+    :return: generator of bytes csv
+    """
+    if header:
+        yield (','.join(
+            _quote(str(name)) for name in dataframe.columns) + '\n').encode()
+    for start in range(0, len(dataframe), chunksize):
+        chunk = dataframe.iloc[start:start + chunksize]
+        columns = [_column_fields(chunk.iloc[:, index], float_format)
+                   for index in range(chunk.shape[1])]
+        yield ''.join(
+            row + '\n' for row in map(','.join, zip(*columns))
+        ).encode()
+
+
+_SPECIAL = re.compile('[,"\r\n]')
+
+
+def _quote(field):
+    if _SPECIAL.search(field) is None:
+        return field
+    return '"' + field.replace('"', '""') + '"'
+
+
+def _column_fields(series, float_format=None):
+    """Return csv fields of each value of a column as list of str."""
+    kind = getattr(series.dtype, 'kind', 'O')
+    if kind in 'iub' and not series.hasnans:
+        return list(map(str, series.tolist()))
+    if kind == 'f':
+        values = series.to_numpy('float64', na_value=float('nan'))
+        fields = list(map(
+            repr if float_format is None else float_format.__mod__,
+            values.tolist()))
+        for index in series.isna().values.nonzero()[0].tolist():
+            fields[index] = ''
+        return fields
+    nulls = series.isna().values
+    return ['' if null else _quote(str(value))
+            for value, null in zip(series.tolist(), nulls)]
 
 
 def to_cstr(x):
@@ -20,6 +89,9 @@ def to_cstr(x):
         return ','.join(k + ':' + v for k, v in x.items())
     elif x is None:
         return None
+    elif is_dataframe(x) or hasattr(x, 'iter_chunks'):
+        # DataFrame or Mcmder given as an input, see Mcmder.mcmd.
+        return x
     else:
         return str(x)
 
@@ -27,10 +99,58 @@ def to_cstr(x):
 def clean_dic(local_dic):
     del local_dic['self']
     del local_dic['options']
-    if '_from' in local_dic:
-        local_dic['from'] = local_dic['_from']
-        del local_dic['_from']
+    for name in ('_from', 'from_'):
+        if name in local_dic:
+            local_dic['from'] = local_dic.pop(name)
     cleaned_dic = {}
     for key, value in local_dic.items():
         cleaned_dic[key] = to_cstr(value)
     return cleaned_dic
+
+
+def split_stages(mcmd_args):
+    """Split M-Command arguments into the arguments of each command.
+
+    :param list mcmd_args: arguments joined by '|'
+    :rtype: list of list
+    """
+    stages = [[]]
+    for arg in mcmd_args or []:
+        if arg == '|':
+            stages.append([])
+        else:
+            stages[-1].append(arg)
+    return stages if stages[0] else []
+
+
+def join_stages(stages):
+    """Join the arguments of each command with '|'.
+
+    :param list stages: list of list of arguments
+    :rtype: list
+    """
+    mcmd_args = []
+    for stage in stages:
+        if mcmd_args:
+            mcmd_args.append('|')
+        mcmd_args.extend(stage)
+    return mcmd_args
+
+
+def stage_options(stage):
+    """Return options given to a command as dict like {'k': 'a,b'}.
+
+    :param list stage: arguments of the command
+    :rtype: dict
+    """
+    return dict(arg.split('=', 1) for arg in stage[1:]
+                if '=' in arg and not arg.startswith('-'))
+
+
+def stage_flags(stage):
+    """Return flags given to a command as set like {'nfn', 'q'}.
+
+    :param list stage: arguments of the command
+    :rtype: set
+    """
+    return set(arg[1:] for arg in stage[1:] if arg.startswith('-'))
@@ -16,7 +16,7 @@ AUTHOR = 'Yusuke Hayashi'
 REQUIRES_PYTHON = '>=3.5.0'
 VERSION = None
 REQUIRED = ['pandas']
-EXTRAS = {}
+EXTRAS = {'arrow': ['pyarrow']}
 
 here = os.path.abspath(os.path.dirname(__file__))
 try:
@@ -0,0 +1,25 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STUBS = os.path.join(ROOT, 'benchmarks', 'stubs')
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def stubs(tmp_path, monkeypatch):
+    """Put the stand-ins of benchmarks/stubs/mstub.py first in PATH."""
+    bindir = tmp_path / 'bin'
+    bindir.mkdir()
+    for name in ('mcut', 'mfldname', 'msel', 'msortf', 'msum', 'mtee'):
+        path = bindir / name
+        path.write_text('#!%s\nimport sys\nsys.path.insert(0, %r)\n'
+                        'import mstub\nsys.exit(mstub.main(%r))\n'
+                        % (sys.executable, STUBS, name))
+        path.chmod(0o755)
+    monkeypatch.setenv('PATH', str(bindir) + os.pathsep + os.environ['PATH'])
+    # Keep the registry of the user out of the tests.
+    monkeypatch.setenv('HOME', str(tmp_path))
+    return bindir
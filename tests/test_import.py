@@ -0,0 +1,18 @@
+import os
+import sys
+import json
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules loaded only when they are used.
+LAZY_MODULES = ('pandas', 'numpy', 'pyarrow', 'asyncio')
+
+
+def test_import_does_not_load_pandas():
+    output = subprocess.check_output([
+        sys.executable, '-c',
+        'import sys, json, mcmder\n'
+        'print(json.dumps([name for name in %r if name in sys.modules]))'
+        % (LAZY_MODULES,)], cwd=ROOT)
+    assert json.loads(output.decode()) == []
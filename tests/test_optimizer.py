@@ -0,0 +1,55 @@
+from mcmder import Mcmder
+from mcmder.optimizer import optimize
+from mcmder.utils import split_stages
+
+
+def write_csv(path):
+    with open(str(path), 'w') as csv_file:
+        csv_file.write('id,key,amount\n')
+        for index in range(100):
+            csv_file.write('%d,k%02d,%d\n' % (index, index * 7 % 13, index))
+    return str(path)
+
+
+def check_rewrite(path, chain, note, commands):
+    """Check the optimized chain gives the same output with commands."""
+    optimized = chain(Mcmder(path, optimize=True))
+    explain = optimized.explain()
+    assert note in explain
+    assert 'Optimized (%d commands):' % commands in explain
+    assert optimized.execute(stdout=True) == \
+        chain(Mcmder(path)).execute(stdout=True)
+
+
+def test_merge_cuts(stubs, tmp_path):
+    check_rewrite(write_csv(tmp_path / 'input.csv'),
+                  lambda m: m.mcut(f='id,key:k,amount').mcut(f='k:x,amount'),
+                  'merged', 1)
+
+
+def test_fold_renames(stubs, tmp_path):
+    check_rewrite(write_csv(tmp_path / 'input.csv'),
+                  lambda m: m.mcut(f='id,key').mfldname(f='key:k'),
+                  'folded', 1)
+
+
+def test_drop_cuts(stubs, tmp_path):
+    check_rewrite(write_csv(tmp_path / 'input.csv'),
+                  lambda m: m.msortf(f='key').mcut(f='id,key,amount'),
+                  'dropped', 1)
+
+
+def test_prune_fields(stubs, tmp_path):
+    check_rewrite(write_csv(tmp_path / 'input.csv'),
+                  lambda m: m.msortf(f='key').mcut(f='key,amount'),
+                  'cut key,amount before msortf', 2)
+
+
+def test_filters_stay_after_mcal_of_other_records():
+    for expression in ('#{amount}', 'line(1)'):
+        stages = split_stages(['mcal', 'c=' + expression, 'a=prev', '|',
+                               'msel', 'c=${id}>1'])
+        assert optimize(stages) == (stages, [])
+    stages = split_stages(['mcal', 'c=${amount}*2', 'a=double', '|',
+                           'msel', 'c=${id}>1'])
+    assert optimize(stages)[0][0][0] == 'msel'
@@ -0,0 +1,37 @@
+from mcmder import Mcmder
+
+
+def write_csv(path, rows=1000):
+    with open(str(path), 'w') as csv_file:
+        csv_file.write('id,key,amount\n')
+        for index in range(rows):
+            csv_file.write('%d,k%03d,%d\n' % (index, index * 7 % 97, index))
+    return str(path)
+
+
+def test_parallel_equals_serial(stubs, tmp_path):
+    path = write_csv(tmp_path / 'input.csv')
+    chains = [
+        lambda m: m.msum(f='amount', k='key'),
+        lambda m: m.mcut(f='key,amount').msel(c='1').msum(f='amount', k='key'),
+        lambda m: m.msum(f='amount', k='key,id'),
+    ]
+    for chain in chains:
+        serial = chain(Mcmder(path)).execute(stdout=True)
+        parallel = chain(Mcmder(path).parallel(4, key='key'))
+        assert parallel._partition_plan() is not None
+        assert parallel.execute(stdout=True) == serial
+
+
+def test_parallel_runs_serially(tmp_path):
+    path = write_csv(tmp_path / 'input.csv', rows=1)
+    m = Mcmder(path, validate=False).parallel(4, key='key')
+    assert m.msum(f='amount', k='key')._partition_plan() is not None
+    for chain in [
+            m.mcmd('msed', c='0', v='1', f='key').msum(f='amount', k='key'),
+            m.mcmd('mjoin', 'N', k='key', m=path, f='id').msum(
+                f='amount', k='key'),
+            m.mselstr(f='id', v='1', k='id').msum(f='amount', k='key'),
+            m.mcal(c='#{amount}', a='p').msum(f='amount', k='key'),
+            m.msum(f='amount', k='id')]:
+        assert chain._partition_plan() is None